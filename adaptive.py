@@ -0,0 +1,263 @@
+from canonical import read_exactly
+from container import ADAPTIVE, ADAPTIVE_TRAILER, checksum, pack_header, read_header, replace_when_done
+from encoder import FLUSH_BITS, flush_bits, write_whole_bytes
+
+# Symbols are the 256 byte values plus an end-of-stream marker
+END_OF_STREAM = 256
+SYMBOL_BITS = 9
+
+# A leaf and an internal node per symbol, plus the escape node
+MAX_NODES = 2 * (END_OF_STREAM + 1) + 1
+
+# Bytes read or written per I/O call
+CHUNK_SIZE = 1 << 16
+
+class AdaptiveHuffmanTree:
+    # FGK adaptive Huffman tree. Nodes are list indices; number[] is each
+    # node's place in the sibling ordering (weights never decrease as the
+    # number grows, and the root has the highest number) and node_at[] is
+    # its inverse. The escape node has weight 0 and stands for every symbol
+    # not seen yet.
+    def __init__(self):
+        self.weight = [0] * MAX_NODES
+        self.parent = [-1] * MAX_NODES
+        self.left = [-1] * MAX_NODES
+        self.right = [-1] * MAX_NODES
+        self.symbol = [-1] * MAX_NODES
+        self.number = [0] * MAX_NODES
+        self.node_at = [0] * MAX_NODES
+        self.leaf = [-1] * (END_OF_STREAM + 1)
+        self.root = 0
+        self.escape = 0
+        self.size = 1
+        self.number[0] = MAX_NODES - 1
+        self.node_at[MAX_NODES - 1] = 0
+
+    def code(self, node):
+        # Walk up to the root, collecting the path as an integer code
+        value = 0
+        length = 0
+        while node != self.root:
+            parent = self.parent[node]
+            if self.right[parent] == node:
+                value |= 1 << length
+            length += 1
+            node = parent
+        return value, length
+
+    def encode(self, symbol):
+        node = self.leaf[symbol]
+        if node >= 0:
+            return self.code(node)
+        # Unseen symbol: the escape code followed by the raw symbol
+        value, length = self.code(self.escape)
+        return (value << SYMBOL_BITS) | symbol, length + SYMBOL_BITS
+
+    def block_leader(self, node, leaves_only=False):
+        # Highest-numbered node (or leaf) with the same weight as node
+        weight = self.weight
+        node_at = self.node_at
+        target = weight[node]
+        leader = node
+        number = self.number[node] + 1
+        while number < MAX_NODES and weight[node_at[number]] == target:
+            if not leaves_only or self.left[node_at[number]] < 0:
+                leader = node_at[number]
+            number += 1
+        return leader
+
+    def swap(self, a, b):
+        parent = self.parent
+        left = self.left
+        right = self.right
+        parent_a = parent[a]
+        parent_b = parent[b]
+        if parent_a == parent_b:
+            left[parent_a], right[parent_a] = right[parent_a], left[parent_a]
+        else:
+            if left[parent_a] == a:
+                left[parent_a] = b
+            else:
+                right[parent_a] = b
+            if left[parent_b] == b:
+                left[parent_b] = a
+            else:
+                right[parent_b] = a
+            parent[a] = parent_b
+            parent[b] = parent_a
+        number_a = self.number[a]
+        number_b = self.number[b]
+        self.number[a] = number_b
+        self.number[b] = number_a
+        self.node_at[number_a] = b
+        self.node_at[number_b] = a
+
+    def update(self, symbol):
+        weight = self.weight
+        parent = self.parent
+        node = self.leaf[symbol]
+        if node < 0:
+            # Split the escape node into a new escape node and a leaf for
+            # the symbol, numbered just below it
+            old = self.escape
+            new_escape = self.size
+            node = self.size + 1
+            self.size += 2
+            number = self.number[old]
+            self.left[old] = new_escape
+            self.right[old] = node
+            parent[new_escape] = old
+            parent[node] = old
+            self.number[node] = number - 1
+            self.node_at[number - 1] = node
+            self.number[new_escape] = number - 2
+            self.node_at[number - 2] = new_escape
+            self.symbol[node] = symbol
+            self.leaf[symbol] = node
+            self.escape = new_escape
+
+        if parent[node] == parent[self.escape]:
+            # The escape node's sibling can only trade places with a leaf,
+            # otherwise it could end up below its own parent
+            leader = self.block_leader(node, leaves_only=True)
+            if leader != node:
+                self.swap(node, leader)
+            weight[node] += 1
+            node = parent[node]
+
+        while node != self.root:
+            leader = self.block_leader(node)
+            if leader != node and leader != parent[node]:
+                self.swap(node, leader)
+            weight[node] += 1
+            node = parent[node]
+        weight[node] += 1
+
+
+class AdaptiveHuffmanCoding:
+    # Single-pass Huffman coding: the code adapts as bytes arrive, so there
+    # is no frequency pass and no table in the header, and streams of unknown
+    # length can be coded with constant memory
+
+    def compress_stream(self, input_stream, output_stream):
+        # The length and checksum are unknown until the input ends, so the
+        # header leaves them at zero and a trailer after the end-of-stream
+        # symbol records them
+        output_stream.write(pack_header(ADAPTIVE, 0, 0, 0))
+        tree = AdaptiveHuffmanTree()
+        output = bytearray()
+        acc = 0
+        nbits = 0
+        crc = 0
+        length = 0
+        chunk = input_stream.read(CHUNK_SIZE)
+        while chunk:
+            crc = checksum(chunk, crc)
+            length += len(chunk)
+            for byte in chunk:
+                value, code_length = tree.encode(byte)
+                tree.update(byte)
+                acc = (acc << code_length) | value
+                nbits += code_length
+                if nbits >= FLUSH_BITS:
+                    acc, nbits = write_whole_bytes(acc, nbits, output)
+            output_stream.write(output)
+            output.clear()
+            chunk = input_stream.read(CHUNK_SIZE)
+
+        value, code_length = tree.encode(END_OF_STREAM)
+        acc = (acc << code_length) | value
+        nbits += code_length
+        output += flush_bits(acc, nbits)
+        output += ADAPTIVE_TRAILER.pack(length, crc)
+        output_stream.write(output)
+        return length
+
+    def decompress_stream(self, input_stream, output_stream):
+        header = read_header(input_stream)
+        if header.layout != ADAPTIVE:
+            raise ValueError("Not an adaptive .huff stream")
+        length = 0
+        for chunk in self.decompress_chunks(input_stream):
+            output_stream.write(chunk)
+            length += len(chunk)
+        return length
+
+    def decompress_chunks(self, input_stream, chunk_size=CHUNK_SIZE):
+        # Yield the decoded data of a stream positioned just after its
+        # header, at most chunk_size bytes at a time. The trailer is checked
+        # once the last chunk has been yielded.
+        tree = AdaptiveHuffmanTree()
+        left = tree.left
+        right = tree.right
+        symbols = tree.symbol
+        output = bytearray()
+        crc = 0
+        length = 0
+        data = input_stream.read(CHUNK_SIZE)
+        position = 0
+        acc = 0
+        nbits = 0
+        while True:
+            # Follow the bits down from the root to a leaf
+            node = tree.root
+            while left[node] >= 0:
+                if not nbits:
+                    if position == len(data):
+                        data = read_exactly(input_stream, 1) + input_stream.read(CHUNK_SIZE - 1)
+                        position = 0
+                    acc = data[position]
+                    position += 1
+                    nbits = 8
+                nbits -= 1
+                node = right[node] if (acc >> nbits) & 1 else left[node]
+
+            if node == tree.escape:
+                while nbits < SYMBOL_BITS:
+                    if position == len(data):
+                        data = read_exactly(input_stream, 1) + input_stream.read(CHUNK_SIZE - 1)
+                        position = 0
+                    acc = ((acc & ((1 << nbits) - 1)) << 8) | data[position]
+                    position += 1
+                    nbits += 8
+                nbits -= SYMBOL_BITS
+                symbol = (acc >> nbits) & ((1 << SYMBOL_BITS) - 1)
+                # Only symbols not seen before are escaped
+                if symbol > END_OF_STREAM or tree.leaf[symbol] >= 0:
+                    raise ValueError("Corrupt adaptive .huff stream")
+            else:
+                symbol = symbols[node]
+
+            if symbol == END_OF_STREAM:
+                break
+            tree.update(symbol)
+            output.append(symbol)
+            if len(output) >= chunk_size:
+                crc = checksum(output, crc)
+                length += len(output)
+                yield bytes(output)
+                output.clear()
+
+        crc = checksum(output, crc)
+        length += len(output)
+        if output:
+            yield bytes(output)
+
+        # The rest of the last byte is padding; the trailer follows it
+        trailer = data[position:position + ADAPTIVE_TRAILER.size]
+        trailer += read_exactly(input_stream, ADAPTIVE_TRAILER.size - len(trailer))
+        if ADAPTIVE_TRAILER.unpack(trailer) != (length, crc):
+            raise ValueError("Decompressed data does not match the .huff checksum")
+
+    def compress(self, input_file):
+        compressed_file = input_file + ".huff"
+        with open(input_file, 'rb') as input_stream, open(compressed_file, 'wb') as output_stream:
+            self.compress_stream(input_stream, output_stream)
+        return compressed_file
+
+    def decompress(self, input_file):
+        decompressed_file = input_file.replace('.huff', '')
+        with replace_when_done(decompressed_file) as temporary, open(input_file, 'rb') as input_stream, \
+                open(temporary, 'wb') as output_stream:
+            self.decompress_stream(input_stream, output_stream)
+        return decompressed_file
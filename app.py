@@ -1,6 +1,7 @@
+import io
 import os
 from flask import Flask, request, send_file
-from huffman import HuffmanCoding
+from huffman import BUFFER_SIZE, HuffmanCoding
 
 app = Flask(__name__)
 
@@ -8,6 +9,9 @@ app = Flask(__name__)
 os.makedirs("static/uploads", exist_ok=True)
 os.makedirs("static/compressed/uploads", exist_ok=True)
 
+# HuffmanCoding keeps no per-file state, so every request can share one
+huffman_coding = HuffmanCoding()
+
 @app.route('/')
 def index():
     return '''
@@ -31,16 +35,20 @@ def upload_file():
     if file.filename == '':
         return "No selected file", 400
 
-    filename = file.filename
-    file_path = os.path.join('static/uploads', filename)
-    file.save(file_path)
-
-    huffman_coding = HuffmanCoding()
+    filename = os.path.basename(file.filename)
     try:
+        # Uploads up to BUFFER_SIZE are compressed in memory instead of being
+        # saved and read back. Larger ones, or ones of unknown size, are
+        # saved and compressed from disk, which never holds them in memory.
+        if request.content_length is not None and request.content_length <= BUFFER_SIZE:
+            compressed = huffman_coding.compress_bytes(file.read())
+            return send_file(io.BytesIO(compressed), as_attachment=True, download_name=filename + ".huff")
+
+        file_path = os.path.join('static/uploads', filename)
+        file.save(file_path)
         compressed_file = huffman_coding.compress(file_path)
         compressed_file_path = os.path.join("static/compressed/uploads", os.path.basename(compressed_file))
-        os.rename(compressed_file, compressed_file_path)
-
+        os.replace(compressed_file, compressed_file_path)
         return send_file(compressed_file_path, as_attachment=True)
 
     except Exception as e:
@@ -0,0 +1,112 @@
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from adaptive import AdaptiveHuffmanCoding
+from codebook import codebook_cache
+from histogram import histogram_from_file
+from huffman import HuffmanCoding, length_limit_cost
+
+MAX_CODE_LENGTHS = (11, 12, 15)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def throughput(size, seconds):
+    return size / seconds / 1e6 if seconds else float('inf')
+
+
+def report_length_limits(paths):
+    print("Size cost of capping code lengths, relative to unrestricted Huffman")
+    print("{:<40} {:>10}".format("file", "bytes") + "".join(" {:>8}".format("max " + str(n)) for n in MAX_CODE_LENGTHS))
+    for path in paths:
+        frequency = histogram_from_file(path)
+        costs = "".join(" {:>7.3%}".format(length_limit_cost(frequency, n)) for n in MAX_CODE_LENGTHS)
+        print("{:<40} {:>10}".format(os.path.basename(path)[:40], os.path.getsize(path)) + costs)
+
+
+def report_coders(title, coders, paths):
+    # Compressed size and compress/decompress throughput (MB/s) per coder
+    print(title)
+    print("{:<40} {:>10}".format("file", "bytes") + "".join(
+        " {:>10} {:>7} {:>7}".format(name + " size", "comp", "decomp") for name, coder in coders))
+    with tempfile.TemporaryDirectory() as directory:
+        for path in paths:
+            # Keep the extension, which picks the static table
+            work = os.path.join(directory, 'input' + os.path.splitext(path)[1])
+            size = os.path.getsize(path)
+            row = "{:<40} {:>10}".format(os.path.basename(path)[:40], size)
+            for name, coder in coders:
+                shutil.copyfile(path, work)
+                compressed, compress_time = timed(coder.compress, work)
+                decompressed, decompress_time = timed(coder.decompress, compressed)
+                row += " {:>10} {:>7.2f} {:>7.2f}".format(
+                    os.path.getsize(compressed), throughput(size, compress_time), throughput(size, decompress_time))
+            print(row)
+
+
+def report_adaptive(paths):
+    coders = [("two-pass", HuffmanCoding()), ("adaptive", AdaptiveHuffmanCoding())]
+    report_coders("Single-pass adaptive Huffman against the two-pass coder", coders, paths)
+
+
+def report_split(paths):
+    coders = [("single", HuffmanCoding()), ("split", HuffmanCoding(split_tables=True))]
+    report_coders("One code table per file against tables switched per segment", coders, paths)
+
+
+def report_interleaved(paths):
+    coders = [("single", HuffmanCoding()), ("4-stream", HuffmanCoding(interleaved=True))]
+    report_coders("Decode throughput of one bitstream against four interleaved streams", coders, paths)
+
+
+def report_static(paths):
+    coders = [("own table", HuffmanCoding()), ("static", HuffmanCoding(static_ratio=1.05))]
+    report_coders("Per-file tables against the shipped static tables (within 5%)", coders, paths)
+
+
+def report_cache(paths):
+    codebook_cache.clear()
+    coders = [("no cache", HuffmanCoding()), ("cached", HuffmanCoding(use_cache=True))]
+    report_coders("Building every codebook against the process-wide codebook cache", coders, paths)
+    print("cache: {} hits, {} misses, {} codebooks".format(codebook_cache.hits, codebook_cache.misses,
+                                                          len(codebook_cache)))
+
+
+def report_context(paths):
+    coders = [("order-0", HuffmanCoding()), ("order-1", HuffmanCoding(context_model=True))]
+    report_coders("Order-0 coding against order-1 context-modelled tables", coders, paths)
+
+
+def report_extended(paths):
+    coders = [("bytes", HuffmanCoding()), ("extended", HuffmanCoding(extended_alphabet=True))]
+    report_coders("Byte alphabet against bytes plus frequent pairs and words", coders, paths)
+
+
+REPORTS = {
+    'lengths': report_length_limits,
+    'adaptive': report_adaptive,
+    'split': report_split,
+    'interleaved': report_interleaved,
+    'static': report_static,
+    'cache': report_cache,
+    'context': report_context,
+    'extended': report_extended,
+}
+
+
+if __name__ == "__main__":
+    # python benchmark.py [report] [files...]; runs every report by default
+    args = sys.argv[1:]
+    reports = [REPORTS[args.pop(0)]] if args and args[0] in REPORTS else list(REPORTS.values())
+    paths = args or sorted(path for path in glob.glob('uploads/*') if os.path.getsize(path))
+    for report in reports:
+        report(paths)
+        print()
@@ -0,0 +1,94 @@
+# Code-length table layouts stored in the .huff header
+NIBBLE_TABLE = 0
+RUN_LENGTH_TABLE = 1
+
+# Longest code that fits in a nibble-packed table
+MAX_NIBBLE_LENGTH = 15
+
+# Largest stored table: the kind byte and a (run, length) pair per byte
+MAX_TABLE_SIZE = 1 + 2 * 256
+
+# Longest code in any codebook. A decode table's second-level tables hold
+# 2 ** (length - LOOKUP_BITS) entries, so unbounded lengths would let a few
+# header bytes ask for gigabytes; codes are length-limited to this when
+# built, and longer ones in a file are rejected as corrupt.
+MAX_CODE_LENGTH = 24
+
+
+def canonical_codes(lengths):
+    # Assign codes in (length, byte) order so that the lengths alone are
+    # enough to rebuild the same codes when decoding
+    length_counts = [0] * (max(lengths) + 1)
+    for length in lengths:
+        length_counts[length] += 1
+    length_counts[0] = 0
+
+    # First code of each length, then hand them out in byte order
+    next_code = [0] * len(length_counts)
+    code = 0
+    for length in range(1, len(length_counts)):
+        code = (code + length_counts[length - 1]) << 1
+        next_code[length] = code
+
+    values = [0] * len(lengths)
+    for byte, length in enumerate(lengths):
+        if length:
+            values[byte] = next_code[length]
+            next_code[length] += 1
+    return values
+
+
+def pack_code_lengths(lengths):
+    # Run-length coded (run - 1, length) pairs
+    count = len(lengths)
+    runs = bytearray()
+    byte = 0
+    while byte < count:
+        run = 1
+        while byte + run < count and run < 256 and lengths[byte + run] == lengths[byte]:
+            run += 1
+        runs += bytes((run - 1, lengths[byte]))
+        byte += run
+
+    # A nibble per length, two lengths per byte
+    if max(lengths) <= MAX_NIBBLE_LENGTH and len(runs) >= (count + 1) // 2:
+        padded = list(lengths) + [0] * (count & 1)
+        nibbles = bytes((padded[i] << 4) | padded[i + 1] for i in range(0, count, 2))
+        return bytes((NIBBLE_TABLE,)) + nibbles
+    return bytes((RUN_LENGTH_TABLE,)) + bytes(runs)
+
+
+def check_code_lengths(lengths, max_length=MAX_CODE_LENGTH):
+    # Lengths a decode table can be built from: none above max_length, and
+    # no more codes than fit (a Kraft sum of at most 1)
+    if max(lengths, default=0) > max_length:
+        raise ValueError("Code longer than {} bits in a code-length table".format(max_length))
+    if sum(1 << (max_length - length) for length in lengths if length) > 1 << max_length:
+        raise ValueError("Over-subscribed code-length table")
+
+
+def read_exactly(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated Huffman header")
+    return data
+
+
+def read_code_lengths(file, count=256):
+    # The code lengths of count symbols, as written by pack_code_lengths
+    kind = read_exactly(file, 1)[0]
+    if kind == NIBBLE_TABLE:
+        lengths = []
+        for packed in read_exactly(file, (count + 1) // 2):
+            lengths.append(packed >> 4)
+            lengths.append(packed & 0x0F)
+        return lengths[:count]
+    if kind == RUN_LENGTH_TABLE:
+        lengths = []
+        while len(lengths) < count:
+            run, length = read_exactly(file, 2)
+            lengths.extend([length] * (run + 1))
+        if len(lengths) != count:
+            raise ValueError("Corrupt code-length table")
+        return lengths
+    raise ValueError("Unknown code-length table type: {}".format(kind))
@@ -0,0 +1,91 @@
+def encoded_bits(frequency, lengths):
+    return sum(count * length for count, length in zip(frequency, lengths))
+
+
+def huffman_code_lengths(frequency):
+    # Moffat-Katajainen: optimal code lengths computed in place over the
+    # weights sorted in ascending order, with no tree or heap. Symbols are
+    # usually the 256 byte values, but any alphabet size works.
+    order = sorted((byte for byte in range(len(frequency)) if frequency[byte]), key=lambda byte: frequency[byte])
+    lengths = [0] * len(frequency)
+    n = len(order)
+    if n == 1:
+        lengths[order[0]] = 1
+    if n <= 1:
+        return lengths
+
+    # Phase 1: merge the two lightest of the leaves and the internal nodes,
+    # storing each internal node's weight and then its parent's index
+    weights = [frequency[byte] for byte in order]
+    weights[0] += weights[1]
+    root = 0
+    leaf = 2
+    for node in range(1, n - 1):
+        if leaf >= n or weights[root] < weights[leaf]:
+            weights[node] = weights[root]
+            weights[root] = node
+            root += 1
+        else:
+            weights[node] = weights[leaf]
+            leaf += 1
+        if leaf >= n or (root < node and weights[root] < weights[leaf]):
+            weights[node] += weights[root]
+            weights[root] = node
+            root += 1
+        else:
+            weights[node] += weights[leaf]
+            leaf += 1
+
+    # Phase 2: parent indices to internal node depths
+    weights[n - 2] = 0
+    for node in range(n - 3, -1, -1):
+        weights[node] = weights[weights[node]] + 1
+
+    # Phase 3: internal node depths to leaf depths, deepest leaves first
+    available = 1
+    used = 0
+    depth = 0
+    root = n - 2
+    node = n - 1
+    while available > 0:
+        while root >= 0 and weights[root] == depth:
+            used += 1
+            root -= 1
+        while available > used:
+            weights[node] = depth
+            node -= 1
+            available -= 1
+        available = 2 * used
+        depth += 1
+        used = 0
+
+    for byte, length in zip(order, weights):
+        lengths[byte] = length
+    return lengths
+
+
+def limited_code_lengths(frequency, max_length):
+    # Package-merge: optimal code lengths with no code longer than max_length
+    symbols = [byte for byte in range(len(frequency)) if frequency[byte]]
+    lengths = [0] * len(frequency)
+    if len(symbols) == 1:
+        lengths[symbols[0]] = 1
+    if len(symbols) <= 1:
+        return lengths
+    if len(symbols) > (1 << max_length):
+        raise ValueError("{} symbols do not fit in {}-bit codes".format(len(symbols), max_length))
+
+    leaves = sorted(([frequency[byte], [byte]] for byte in symbols), key=lambda item: item[0])
+    items = leaves
+    for _ in range(max_length - 1):
+        packages = []
+        for i in range(0, len(items) - 1, 2):
+            packages.append([items[i][0] + items[i + 1][0], items[i][1] + items[i + 1][1]])
+        items = sorted(leaves + packages, key=lambda item: item[0])
+
+    # Each time a symbol appears in the cheapest 2n - 2 items its code gets
+    # one bit longer
+    for weight, members in items[:2 * len(symbols) - 2]:
+        for byte in members:
+            lengths[byte] += 1
+    return lengths
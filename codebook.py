@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+from math import log2
+
+from canonical import MAX_CODE_LENGTH, canonical_codes, check_code_lengths, pack_code_lengths, read_code_lengths
+from code_lengths import huffman_code_lengths, limited_code_lengths
+from decoder import DecodeTable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Codebooks kept by the process-wide cache
+CACHE_SIZE = 64
+
+# Histogram fingerprints record each byte's ideal code length in steps of
+# 1 / FINGERPRINT_STEPS bits
+FINGERPRINT_STEPS = 2
+
+
+class Codebook:
+    # A canonical code and everything derived from it: each byte's code
+    # length and value, the table stored in .huff files and the decode table.
+    # Nothing changes after construction, so a codebook can be shared between
+    # threads, or inherited by forked worker processes, without locking.
+    __slots__ = ('lengths', 'values', 'max_length', 'table', 'decode_table', 'numpy_codes')
+
+    def __init__(self, lengths):
+        lengths = tuple(lengths)
+        check_code_lengths(lengths)
+        values = tuple(canonical_codes(lengths))
+        numpy_codes = None
+        # The vectorised encoder packs codes into 64-bit words, so it needs
+        # every code to fit in one word
+        if np is not None and max(lengths) <= 64:
+            numpy_codes = (np.array(values, dtype=np.uint64), np.array(lengths, dtype=np.int64))
+            for array in numpy_codes:
+                array.setflags(write=False)
+        set_field = super().__setattr__
+        set_field('lengths', lengths)
+        set_field('values', values)
+        set_field('max_length', max(lengths))
+        set_field('table', pack_code_lengths(lengths))
+        set_field('decode_table', DecodeTable(lengths))
+        set_field('numpy_codes', numpy_codes)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Codebook is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Codebook is immutable")
+
+    @classmethod
+    def from_frequencies(cls, frequency, max_code_length=None):
+        # Optimal code lengths for the histogram, length-limited only when
+        # the unrestricted code is longer than max_code_length or, without
+        # one, MAX_CODE_LENGTH
+        max_code_length = min(max_code_length or MAX_CODE_LENGTH, MAX_CODE_LENGTH)
+        lengths = huffman_code_lengths(frequency)
+        if max(lengths) > max_code_length:
+            lengths = limited_code_lengths(frequency, max_code_length)
+        return cls(lengths)
+
+    @classmethod
+    def read(cls, file):
+        return cls(read_code_lengths(file))
+
+    def covers(self, frequency):
+        # Whether every byte that occurs in the histogram has a code
+        return all(self.lengths[byte] or not frequency[byte] for byte in range(256))
+
+
+def histogram_fingerprint(frequency):
+    # Histograms with the same fingerprint have nearly the same optimal code,
+    # and the same set of bytes, so one codebook serves them all
+    total = sum(frequency)
+    return tuple(max(1, round(FINGERPRINT_STEPS * log2(total / count))) if count else 0 for count in frequency)
+
+
+class CodebookCache:
+    # LRU cache of up to max_size codebooks, so similar inputs skip building
+    # codes and decode tables. Codebooks are found by histogram fingerprint
+    # when compressing and by their exact code lengths when decompressing;
+    # either way leads to the same entry, so each codebook counts once.
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Code lengths -> (codebook, fingerprint keys that lead to it), least
+        # recently used first
+        self.entries = OrderedDict()
+        # Fingerprint key -> code lengths of an entry
+        self.fingerprints = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, lengths):
+        with self.lock:
+            entry = self.entries.get(lengths)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(lengths)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, codebook, fingerprint=None):
+        # Add codebook, found from then on by its lengths and by fingerprint
+        # if given. Returns the cached codebook with those lengths, which is
+        # an earlier one if another thread built the same codebook first.
+        with self.lock:
+            entry = self.entries.get(codebook.lengths)
+            if entry is None:
+                entry = self.entries[codebook.lengths] = (codebook, [])
+            self.entries.move_to_end(codebook.lengths)
+            if fingerprint is not None and fingerprint not in self.fingerprints:
+                self.fingerprints[fingerprint] = codebook.lengths
+                entry[1].append(fingerprint)
+            while len(self.entries) > self.max_size:
+                lengths, (evicted, fingerprints) = self.entries.popitem(last=False)
+                for key in fingerprints:
+                    del self.fingerprints[key]
+            return entry[0]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.fingerprints.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def from_frequencies(self, frequency, max_code_length=None):
+        fingerprint = (max_code_length or 0, histogram_fingerprint(frequency))
+        with self.lock:
+            lengths = self.fingerprints.get(fingerprint)
+        codebook = self.get(lengths)
+        if codebook is None:
+            codebook = self.put(Codebook.from_frequencies(frequency, max_code_length), fingerprint)
+        return codebook
+
+    def from_lengths(self, lengths):
+        lengths = tuple(lengths)
+        codebook = self.get(lengths)
+        if codebook is None:
+            codebook = self.put(Codebook(lengths))
+        return codebook
+
+    def read(self, file):
+        return self.from_lengths(read_code_lengths(file))
+
+
+# Shared by every HuffmanCoding created with use_cache=True
+codebook_cache = CodebookCache()
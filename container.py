@@ -0,0 +1,178 @@
+import os
+import struct
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+
+from canonical import read_exactly
+
+MAGIC = b'HUFF'
+VERSION = 1
+
+# Payload layouts that can follow the header
+SINGLE_TABLE = 0
+BLOCKS = 1
+ADAPTIVE = 2
+SPLIT = 3
+INTERLEAVED = 4
+STATIC = 5
+CONTEXT = 6
+EXTENDED = 7
+
+# magic, version, layout, max code length (0 = unlimited), original length,
+# CRC-32 of the original data
+HEADER = struct.Struct('>4sBBBQI')
+
+# Block layout: the block size and block count follow the header, then an
+# index entry per block (file offset, size in the file, original size), then
+# the blocks. Each block is its original size, the size of its code-length
+# table plus payload, its CRC-32, and then the table and payload themselves.
+BLOCK_LAYOUT = struct.Struct('>II')
+BLOCK_INDEX_ENTRY = struct.Struct('>QII')
+BLOCK_HEADER = struct.Struct('>III')
+
+# Split layout: segments follow the header back to back. Each is its original
+# size, its payload size and whether it brings a new code-length table (1) or
+# keeps the previous one (0), then the table if any, then the payload.
+SEGMENT_HEADER = struct.Struct('>IIB')
+
+# Interleaved layout: the code-length table, then the payload size of each of
+# STREAM_COUNT streams, then the streams. Byte i of the original data is coded
+# in stream i % STREAM_COUNT, so a decoder can follow all of them at once.
+STREAM_COUNT = 4
+INTERLEAVED_STREAMS = struct.Struct('>{}I'.format(STREAM_COUNT))
+
+# Static layout: the ID of one of the tables shipped in static_tables takes
+# the place of the code-length table; the payload is as for SINGLE_TABLE
+STATIC_TABLE_ID = struct.Struct('>B')
+
+# Context layout: a context map and the code tables it points to (see
+# ContextModel.table), then a payload as for SINGLE_TABLE except that each
+# byte is coded with the table for the byte before it (0 before the first)
+
+# Extended layout: the number of phrases, then each phrase as its length in a
+# byte followed by its bytes. Then a code-length table for 256 + that many
+# symbols, where symbol 256 + i stands for phrase i, and a payload as for
+# SINGLE_TABLE with a code per symbol.
+PHRASE_COUNT = struct.Struct('>H')
+
+# Adaptive layout: the header's length and checksum are left at zero, and the
+# coded stream ends with an end-of-stream symbol, zero bits up to a byte
+# boundary and this trailer (original length, CRC-32)
+ADAPTIVE_TRAILER = struct.Struct('>QI')
+
+Header = namedtuple('Header', ['layout', 'max_code_length', 'original_length', 'checksum'])
+BlockHeader = namedtuple('BlockHeader', ['original_size', 'compressed_size', 'checksum'])
+BlockIndexEntry = namedtuple('BlockIndexEntry', ['offset', 'size', 'original_size'])
+SegmentHeader = namedtuple('SegmentHeader', ['original_size', 'payload_size', 'new_table'])
+
+
+def checksum(data, value=0):
+    return zlib.crc32(data, value)
+
+
+def pack_header(layout, max_code_length, original_length, crc):
+    return HEADER.pack(MAGIC, VERSION, layout, max_code_length or 0, original_length, crc)
+
+
+def read_header(file):
+    magic, version, layout, max_code_length, original_length, crc = HEADER.unpack(
+        read_exactly(file, HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("Not a .huff file")
+    if version != VERSION:
+        raise ValueError("Unsupported .huff version: {}".format(version))
+    return Header(layout, max_code_length, original_length, crc)
+
+
+def pack_block_header(original_size, compressed_size, crc):
+    return BLOCK_HEADER.pack(original_size, compressed_size, crc)
+
+
+def read_block_header(file, entry=None):
+    # entry, if given, is the block's index entry, which has to agree with
+    # the header on both sizes
+    block_header = BlockHeader(*BLOCK_HEADER.unpack(read_exactly(file, BLOCK_HEADER.size)))
+    if entry is not None and (block_header.original_size != entry.original_size
+                              or BLOCK_HEADER.size + block_header.compressed_size != entry.size):
+        raise ValueError("Block header does not match the block index")
+    return block_header
+
+
+def block_index_size(block_count):
+    return BLOCK_LAYOUT.size + block_count * BLOCK_INDEX_ENTRY.size
+
+
+def pack_block_index(block_size, entries):
+    index = bytearray(BLOCK_LAYOUT.pack(block_size, len(entries)))
+    for entry in entries:
+        index += BLOCK_INDEX_ENTRY.pack(*entry)
+    return bytes(index)
+
+
+def read_block_index(file, original_length, file_size=None):
+    # Every block but the last holds block_size bytes of the original data
+    # and the last holds the rest, so the index must agree with the header's
+    # original_length before a block is looked up by position in it. Each
+    # block must also lie between the end of the index and the end of the
+    # file, which is file_size bytes long (by default, wherever file ends).
+    block_size, block_count = BLOCK_LAYOUT.unpack(read_exactly(file, BLOCK_LAYOUT.size))
+    if not block_size or block_count != -(-original_length // block_size):
+        raise ValueError("Block index does not match the .huff header")
+    index = read_exactly(file, block_count * BLOCK_INDEX_ENTRY.size)
+    entries = [BlockIndexEntry(*entry) for entry in BLOCK_INDEX_ENTRY.iter_unpack(index)]
+    sizes = [block_size] * block_count
+    if sizes:
+        sizes[-1] = original_length - (block_count - 1) * block_size
+    if [entry.original_size for entry in entries] != sizes:
+        raise ValueError("Block index does not match the .huff header")
+    index_end = file.tell()
+    if file_size is None:
+        file_size = file.seek(0, os.SEEK_END)
+        file.seek(index_end)
+    for entry in entries:
+        if entry.offset < index_end or not BLOCK_HEADER.size <= entry.size <= file_size - entry.offset:
+            raise ValueError("Block index points outside the .huff file")
+    return block_size, entries
+
+
+def pack_segment_header(original_size, payload_size, new_table):
+    return SEGMENT_HEADER.pack(original_size, payload_size, 1 if new_table else 0)
+
+
+def read_segment_header(file):
+    return SegmentHeader(*SEGMENT_HEADER.unpack(read_exactly(file, SEGMENT_HEADER.size)))
+
+
+@contextmanager
+def replace_when_done(path):
+    # Yield the name of an empty file next to path for the output to be
+    # written to. It replaces path only if the with block finishes, so a
+    # decode that fails, e.g. on a checksum mismatch, leaves neither partial
+    # nor unverified output behind.
+    temporary = '{}.{}.part'.format(path, os.urandom(4).hex())
+    open(temporary, 'xb').close()
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def check_length(length, payload_size, symbol_size=1):
+    # Every code is at least a bit long, so payload_size bytes hold at most
+    # 8 * payload_size symbols of up to symbol_size bytes each. A longer
+    # length comes from a corrupt header, and is rejected before an output
+    # of that size is allocated or mapped.
+    if length > 8 * payload_size * symbol_size:
+        raise ValueError("Length in the .huff header does not fit its payload")
+
+
+def verify_checksum(header, length, crc):
+    if length != header.original_length or crc != header.checksum:
+        raise ValueError("Decompressed data does not match the .huff checksum")
+
+
+def verify(header, data):
+    verify_checksum(header, len(data), checksum(data))
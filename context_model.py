@@ -0,0 +1,196 @@
+from canonical import pack_code_lengths, read_code_lengths, read_exactly
+from codebook import Codebook
+from decoder import check_payload
+from encoder import FLUSH_BITS, NUMPY_CHUNK_SIZE, pack_codes, write_whole_bytes
+from splitting import TABLE_COST_BITS, estimated_bits
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Most code tables in one context model; the count is stored in a byte
+MAX_CONTEXT_TABLES = 32
+
+# The busiest contexts start as clusters of their own and the rest share
+# one, which keeps the pairwise merging in cluster_contexts cheap
+MAX_INITIAL_CLUSTERS = 64
+
+
+def cluster_contexts(context_histograms, max_tables=MAX_CONTEXT_TABLES, table_cost_bits=TABLE_COST_BITS):
+    # Group the contexts so that each group shares a code table. Starting
+    # from one group per busy context, repeatedly merge the two groups whose
+    # merge adds the fewest bits, for as long as that is less than the table
+    # it saves or there are more than max_tables groups. Returns the group
+    # of every context (unused contexts go in group 0) and each group's
+    # histogram.
+    # Histograms are kept as {byte: count} while merging, since most
+    # contexts are followed by only a few different bytes
+    used = sorted((context for context in range(256) if any(context_histograms[context])),
+                  key=lambda context: -sum(context_histograms[context]))
+    groups = {}
+    for number, context in enumerate(used[:MAX_INITIAL_CLUSTERS]):
+        groups[number] = ([context], {byte: count for byte, count in enumerate(context_histograms[context]) if count})
+    if len(used) > MAX_INITIAL_CLUSTERS:
+        rare = used[MAX_INITIAL_CLUSTERS:]
+        histogram = {}
+        for context in rare:
+            for byte, count in enumerate(context_histograms[context]):
+                if count:
+                    histogram[byte] = histogram.get(byte, 0) + count
+        groups[len(groups)] = (rare, histogram)
+    bits = {number: estimated_bits(histogram.values()) for number, (contexts, histogram) in groups.items()}
+
+    def merge_cost(a, b):
+        merged = dict(groups[a][1])
+        for byte, count in groups[b][1].items():
+            merged[byte] = merged.get(byte, 0) + count
+        return estimated_bits(merged.values()) - bits[a] - bits[b], merged
+
+    costs = {}
+    for a in groups:
+        for b in groups:
+            if a < b:
+                costs[a, b] = merge_cost(a, b)
+    next_number = len(groups)
+    while len(groups) > 1:
+        (a, b), (extra_bits, merged) = min(costs.items(), key=lambda item: item[1][0])
+        if extra_bits >= table_cost_bits and len(groups) <= max_tables:
+            break
+        contexts = groups.pop(a)[0] + groups.pop(b)[0]
+        del bits[a], bits[b]
+        costs = {pair: cost for pair, cost in costs.items() if a not in pair and b not in pair}
+        groups[next_number] = (contexts, merged)
+        bits[next_number] = estimated_bits(merged.values())
+        for other in groups:
+            if other != next_number:
+                costs[other, next_number] = merge_cost(other, next_number)
+        next_number += 1
+
+    context_map = [0] * 256
+    histograms = []
+    for table, (contexts, counts) in enumerate(groups.values()):
+        for context in contexts:
+            context_map[context] = table
+        histograms.append([counts.get(byte, 0) for byte in range(256)])
+    return context_map, histograms or [[0] * 256]
+
+
+class ContextModel:
+    # Order-1 model: a code table per group of preceding-byte contexts. As
+    # with Codebook, nothing changes after construction. The codes of all
+    # tables sit in flat tuples indexed by (table << 8) | byte, and
+    # offsets[context] is table << 8, so choosing the table for a byte is a
+    # single lookup in the hot loops.
+    __slots__ = ('context_map', 'codebooks', 'offsets', 'values', 'lengths', 'max_length', 'refill_bytes',
+                 'numpy_codes', 'decode_contexts')
+
+    def __init__(self, context_map, codebooks):
+        context_map = tuple(context_map)
+        codebooks = tuple(codebooks)
+        offsets = tuple(table << 8 for table in context_map)
+        values = tuple(value for codebook in codebooks for value in codebook.values)
+        lengths = tuple(length for codebook in codebooks for length in codebook.lengths)
+        max_length = max(codebook.max_length for codebook in codebooks)
+        numpy_codes = None
+        if np is not None and max_length <= 64:
+            numpy_codes = (np.array(offsets, dtype=np.int64), np.array(values, dtype=np.uint64),
+                           np.array(lengths, dtype=np.int64))
+            for array in numpy_codes:
+                array.setflags(write=False)
+        set_field = super().__setattr__
+        set_field('context_map', context_map)
+        set_field('codebooks', codebooks)
+        set_field('offsets', offsets)
+        set_field('values', values)
+        set_field('lengths', lengths)
+        set_field('max_length', max_length)
+        set_field('refill_bytes', max(codebook.decode_table.refill_bytes for codebook in codebooks))
+        set_field('numpy_codes', numpy_codes)
+        # Everything decode_context_symbols needs about each context's table
+        set_field('decode_contexts', tuple(
+            (table.table, table.bits, (1 << table.bits) - 1, table.subtables)
+            for table in (codebooks[number].decode_table for number in context_map)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ContextModel is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ContextModel is immutable")
+
+    @classmethod
+    def from_contexts(cls, context_histograms, max_code_length=None):
+        context_map, histograms = cluster_contexts(context_histograms)
+        return cls(context_map, [Codebook.from_frequencies(histogram, max_code_length) for histogram in histograms])
+
+    @classmethod
+    def read(cls, file):
+        context_map = read_code_lengths(file)
+        table_count = read_exactly(file, 1)[0]
+        if not table_count or max(context_map) >= table_count:
+            raise ValueError("Corrupt context map")
+        return cls(context_map, [Codebook.read(file) for _ in range(table_count)])
+
+    @property
+    def table(self):
+        # The context map, packed like a code-length table, then the number
+        # of tables and the tables themselves
+        return pack_code_lengths(self.context_map) + bytes((len(self.codebooks),)) + b''.join(
+            codebook.table for codebook in self.codebooks)
+
+
+def encode_context(model, data, output, acc=0, nbits=0, previous=0, use_numpy=True):
+    # Like encoder.encode, with each byte coded by the table for the byte
+    # before it; previous is the byte before data
+    if use_numpy and model.numpy_codes is not None:
+        return encode_context_numpy(model, data, output, acc, nbits, previous)
+    offsets = model.offsets
+    values = model.values
+    lengths = model.lengths
+    for byte in data:
+        code = offsets[previous] | byte
+        length = lengths[code]
+        acc = (acc << length) | values[code]
+        nbits += length
+        previous = byte
+        if nbits >= FLUSH_BITS:
+            acc, nbits = write_whole_bytes(acc, nbits, output)
+    return acc, nbits
+
+
+def encode_context_numpy(model, data, output, acc=0, nbits=0, previous=0):
+    offsets, values, lengths = model.numpy_codes
+    symbols = np.frombuffer(data, dtype=np.uint8)
+    for start in range(0, len(symbols), NUMPY_CHUNK_SIZE):
+        chunk = symbols[start:start + NUMPY_CHUNK_SIZE]
+        contexts = np.empty(len(chunk), dtype=np.int64)
+        contexts[0] = symbols[start - 1] if start else previous
+        contexts[1:] = chunk[:-1]
+        codes = offsets[contexts] | chunk
+        acc, nbits = pack_codes(values[codes], lengths[codes], output, acc, nbits)
+    return acc, nbits
+
+
+def decode_context_symbols(output, data, position, acc, nbits, previous, model, end=None):
+    # decoder.decode_symbols with the lookup table picked by the previous
+    # byte. Returns the state to carry on from, including that byte.
+    contexts = model.decode_contexts
+    max_length = model.max_length
+    refill_bytes = model.refill_bytes
+    refill_bits = refill_bytes * 8
+    for i in range(len(output)):
+        if nbits < max_length:
+            acc = ((acc & ((1 << nbits) - 1)) << refill_bits) | int.from_bytes(
+                data[position:position + refill_bytes], 'big')
+            position += refill_bytes
+            nbits += refill_bits
+        table, bits, mask, subtables = contexts[previous]
+        entry = table[(acc >> (nbits - bits)) & mask]
+        if entry < 0:
+            sub_bits, subtable = subtables[~entry]
+            entry = subtable[(acc >> (nbits - bits - sub_bits)) & ((1 << sub_bits) - 1)]
+        previous = entry & 0xFF
+        output[i] = previous
+        nbits -= entry >> 8
+    check_payload(position, nbits, end)
+    return position, acc, nbits, previous
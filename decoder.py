@@ -0,0 +1,266 @@
+import io
+
+from canonical import canonical_codes
+from container import STREAM_COUNT
+
+# Bits peeked per first-level table lookup
+LOOKUP_BITS = 11
+
+# Decoded bytes yielded per step by decode_stream
+CHUNK_SIZE = 1 << 16
+
+
+class DecodeTable:
+    def __init__(self, lengths, lookup_bits=LOOKUP_BITS):
+        self.max_length = max(lengths)
+        # Bits that hold the symbol in each entry: 8 for byte alphabets
+        self.symbol_bits = max(8, (len(lengths) - 1).bit_length())
+        self.bits = min(lookup_bits, self.max_length)
+        # Read whole bytes at a time, enough to always hold the longest code
+        self.refill_bytes = max(8, (self.max_length + 7) // 8)
+
+        # Entries are (code length << symbol_bits) | symbol. Codes longer
+        # than the first-level table store ~index of a second-level table
+        # instead.
+        self.table = [0] * (1 << self.bits)
+        self.subtables = []
+        values = canonical_codes(lengths)
+        long_codes = {}
+        for byte, length in enumerate(lengths):
+            if not length:
+                continue
+            entry = (length << self.symbol_bits) | byte
+            if length <= self.bits:
+                start = values[byte] << (self.bits - length)
+                count = 1 << (self.bits - length)
+                self.table[start:start + count] = [entry] * count
+            else:
+                prefix = values[byte] >> (length - self.bits)
+                long_codes.setdefault(prefix, []).append((values[byte], length, entry))
+
+        for prefix, codes in long_codes.items():
+            sub_bits = max(length for value, length, entry in codes) - self.bits
+            subtable = [0] * (1 << sub_bits)
+            for value, length, entry in codes:
+                suffix_bits = length - self.bits
+                start = (value & ((1 << suffix_bits) - 1)) << (sub_bits - suffix_bits)
+                count = 1 << (sub_bits - suffix_bits)
+                subtable[start:start + count] = [entry] * count
+            self.table[prefix] = ~len(self.subtables)
+            self.subtables.append((sub_bits, subtable))
+
+
+def remaining_size(file):
+    # Bytes after the current position, in a file or a BytesIO alike
+    position = file.tell()
+    size = file.seek(0, io.SEEK_END) - position
+    file.seek(position)
+    return size
+
+
+def read_payload(file, size, decode_table):
+    # Read the payload in one go into a buffer with zero padding after it,
+    # so decode can refill whole words past the end without bounds checks
+    payload = bytearray(size + decode_table.refill_bytes)
+    if file.readinto(memoryview(payload)[:size]) != size:
+        raise ValueError("Truncated .huff payload")
+    return payload
+
+
+def check_payload(position, nbits, end):
+    # The codes decoded so far take 8 * position - nbits bits. In valid data
+    # they all come from the payload, which ends at byte end; reaching
+    # further means they were decoded from the zero padding after it.
+    if end is not None and 8 * position - nbits > 8 * end:
+        raise ValueError("Truncated .huff payload")
+
+
+def decode_symbols(output, data, position, acc, nbits, decode_table, end=None):
+    # Fill output with decoded bytes, reading data from position onwards.
+    # acc holds nbits already-read bits; the updated state is returned so a
+    # caller can carry on from where this call stopped. With end, the
+    # payload's real size in data, running out of payload raises ValueError.
+    table = decode_table.table
+    subtables = decode_table.subtables
+    bits = decode_table.bits
+    mask = (1 << bits) - 1
+    max_length = decode_table.max_length
+    refill_bytes = decode_table.refill_bytes
+    refill_bits = refill_bytes * 8
+    for i in range(len(output)):
+        if nbits < max_length:
+            acc = ((acc & ((1 << nbits) - 1)) << refill_bits) | int.from_bytes(
+                data[position:position + refill_bytes], 'big')
+            position += refill_bytes
+            nbits += refill_bits
+        entry = table[(acc >> (nbits - bits)) & mask]
+        if entry < 0:
+            sub_bits, subtable = subtables[~entry]
+            entry = subtable[(acc >> (nbits - bits - sub_bits)) & ((1 << sub_bits) - 1)]
+        output[i] = entry & 0xFF
+        nbits -= entry >> 8
+    check_payload(position, nbits, end)
+    return position, acc, nbits
+
+
+def decode(payload, decode_table, count, padded=False):
+    output = bytearray(count)
+    if count:
+        # Zero bytes past the end let the last refills read a full word
+        if padded:
+            data = payload
+            end = len(payload) - decode_table.refill_bytes
+        else:
+            data = bytes(payload) + bytes(decode_table.refill_bytes)
+            end = len(payload)
+        decode_symbols(output, data, 0, 0, 0, decode_table, end)
+    return output
+
+
+def read_streams(file, sizes, decode_table):
+    # The interleaved streams, each padded like read_payload's buffer plus one
+    # more word, since decode_interleaved may decode one symbol past the end
+    # of the shorter streams
+    streams = []
+    for size in sizes:
+        stream = bytearray(size + 2 * decode_table.refill_bytes)
+        if file.readinto(memoryview(stream)[:size]) != size:
+            raise ValueError("Truncated .huff payload")
+        streams.append(stream)
+    return streams
+
+
+def decode_interleaved(streams, decode_table, count):
+    # Decode count bytes from STREAM_COUNT padded streams, taking a symbol from
+    # each in turn. Each stream has its own cursor, accumulator and bit count,
+    # all advanced in the same loop iteration; the surplus symbols decoded from
+    # the padding when count is not a multiple of four are dropped at the end.
+    table = decode_table.table
+    subtables = decode_table.subtables
+    bits = decode_table.bits
+    mask = (1 << bits) - 1
+    max_length = decode_table.max_length
+    refill_bytes = decode_table.refill_bytes
+    refill_bits = refill_bytes * 8
+    data0, data1, data2, data3 = streams
+    position0 = position1 = position2 = position3 = 0
+    acc0 = acc1 = acc2 = acc3 = 0
+    nbits0 = nbits1 = nbits2 = nbits3 = 0
+    output = bytearray(count + STREAM_COUNT - 1)
+    for i in range(0, count, STREAM_COUNT):
+        if nbits0 < max_length:
+            acc0 = ((acc0 & ((1 << nbits0) - 1)) << refill_bits) | int.from_bytes(
+                data0[position0:position0 + refill_bytes], 'big')
+            position0 += refill_bytes
+            nbits0 += refill_bits
+        if nbits1 < max_length:
+            acc1 = ((acc1 & ((1 << nbits1) - 1)) << refill_bits) | int.from_bytes(
+                data1[position1:position1 + refill_bytes], 'big')
+            position1 += refill_bytes
+            nbits1 += refill_bits
+        if nbits2 < max_length:
+            acc2 = ((acc2 & ((1 << nbits2) - 1)) << refill_bits) | int.from_bytes(
+                data2[position2:position2 + refill_bytes], 'big')
+            position2 += refill_bytes
+            nbits2 += refill_bits
+        if nbits3 < max_length:
+            acc3 = ((acc3 & ((1 << nbits3) - 1)) << refill_bits) | int.from_bytes(
+                data3[position3:position3 + refill_bytes], 'big')
+            position3 += refill_bytes
+            nbits3 += refill_bits
+        entry0 = table[(acc0 >> (nbits0 - bits)) & mask]
+        entry1 = table[(acc1 >> (nbits1 - bits)) & mask]
+        entry2 = table[(acc2 >> (nbits2 - bits)) & mask]
+        entry3 = table[(acc3 >> (nbits3 - bits)) & mask]
+        if entry0 < 0:
+            sub_bits, subtable = subtables[~entry0]
+            entry0 = subtable[(acc0 >> (nbits0 - bits - sub_bits)) & ((1 << sub_bits) - 1)]
+        if entry1 < 0:
+            sub_bits, subtable = subtables[~entry1]
+            entry1 = subtable[(acc1 >> (nbits1 - bits - sub_bits)) & ((1 << sub_bits) - 1)]
+        if entry2 < 0:
+            sub_bits, subtable = subtables[~entry2]
+            entry2 = subtable[(acc2 >> (nbits2 - bits - sub_bits)) & ((1 << sub_bits) - 1)]
+        if entry3 < 0:
+            sub_bits, subtable = subtables[~entry3]
+            entry3 = subtable[(acc3 >> (nbits3 - bits - sub_bits)) & ((1 << sub_bits) - 1)]
+        output[i] = entry0 & 0xFF
+        output[i + 1] = entry1 & 0xFF
+        output[i + 2] = entry2 & 0xFF
+        output[i + 3] = entry3 & 0xFF
+        nbits0 -= entry0 >> 8
+        nbits1 -= entry1 >> 8
+        nbits2 -= entry2 >> 8
+        nbits3 -= entry3 >> 8
+    del output[count:]
+    return output
+
+
+def decode_interleaved_stream(streams, decode_table, count, chunk_size=CHUNK_SIZE):
+    # Like decode_interleaved, but yielding at most chunk_size bytes at a
+    # time. Each chunk takes its share from every stream with decode_symbols,
+    # which carries each stream's state over to the next chunk.
+    chunk_size = max(chunk_size - chunk_size % STREAM_COUNT, STREAM_COUNT)
+    ends = [len(stream) - 2 * decode_table.refill_bytes for stream in streams]
+    states = [(0, 0, 0)] * STREAM_COUNT
+    for start in range(0, count, chunk_size):
+        output = bytearray(min(chunk_size, count - start))
+        for number, stream in enumerate(streams):
+            part = bytearray(len(range(number, len(output), STREAM_COUNT)))
+            states[number] = decode_symbols(part, stream, *states[number], decode_table, ends[number])
+            output[number::STREAM_COUNT] = part
+        yield bytes(output)
+
+
+def decode_into(output, data, position, decode_table, chunk_size=CHUNK_SIZE):
+    # Decode len(output) bytes into output, e.g. a memory-mapped file, from
+    # data starting at position. data needs no padding after the payload, so
+    # it can be a memory-mapped .huff file: chunks are decoded straight from
+    # it while enough bytes are left for any chunk, and only the last few are
+    # copied into a zero-padded buffer.
+    count = len(output)
+    margin = 2 * decode_table.refill_bytes
+    end = len(data)
+    padded = False
+    acc = 0
+    nbits = 0
+    chunk = bytearray()
+    for start in range(0, count, chunk_size):
+        size = min(chunk_size, count - start)
+        if not padded and len(data) - position < (size * decode_table.max_length + 7) // 8 + margin:
+            data = bytes(data[position:]) + bytes(margin)
+            end -= position
+            position = 0
+            padded = True
+        if len(chunk) != size:
+            chunk = bytearray(size)
+        position, acc, nbits = decode_symbols(chunk, data, position, acc, nbits, decode_table, end)
+        output[start:start + size] = chunk
+
+
+def decode_stream(file, decode_table, count, chunk_size=CHUNK_SIZE):
+    # Decode count bytes from a file positioned at the start of the payload,
+    # yielding at most chunk_size bytes at a time. Only enough payload for
+    # the next chunk is kept in memory: chunk_size codes of the longest
+    # length, plus the refill word and the bits already in the accumulator.
+    # Past the end of the file the payload is padded with zeros, which count
+    # does not reach unless the header is corrupt.
+    needed = ((chunk_size + 1) * decode_table.max_length + 7) // 8 + 2 * decode_table.refill_bytes
+    data = b''
+    end = 0
+    position = 0
+    acc = 0
+    nbits = 0
+    remaining = count
+    while remaining:
+        if len(data) - position < needed:
+            more = file.read(needed)
+            data = data[position:] + more
+            end += len(more) - position
+            if len(more) < needed:
+                data += bytes(needed - len(more))
+            position = 0
+        output = bytearray(min(chunk_size, remaining))
+        position, acc, nbits = decode_symbols(output, data, position, acc, nbits, decode_table, end)
+        remaining -= len(output)
+        yield bytes(output)
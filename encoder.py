@@ -0,0 +1,90 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Flush the bit accumulator to the output once it holds this many bits
+FLUSH_BITS = 256
+
+# Number of input bytes (or symbols) the NumPy encoders handle per
+# vectorised step
+NUMPY_CHUNK_SIZE = 1 << 16
+
+
+def encode(codebook, data, output, acc=0, nbits=0, use_numpy=True):
+    # Append the codes for data to output. acc holds nbits bits left over
+    # from a previous call; the bits left over from this one are returned.
+    # All state is in the arguments, so calls can run on any thread.
+    if use_numpy and codebook.numpy_codes is not None:
+        return encode_numpy(codebook, data, output, acc, nbits)
+    values = codebook.values
+    lengths = codebook.lengths
+    for byte in data:
+        length = lengths[byte]
+        acc = (acc << length) | values[byte]
+        nbits += length
+        if nbits >= FLUSH_BITS:
+            acc, nbits = write_whole_bytes(acc, nbits, output)
+    return acc, nbits
+
+
+def write_whole_bytes(acc, nbits, output):
+    # Append the whole bytes of the nbits bits in acc to output and return
+    # the fewer than 8 bits left over
+    extra = nbits & 7
+    output += (acc >> extra).to_bytes(nbits >> 3, 'big')
+    return acc & ((1 << extra) - 1), extra
+
+
+def flush_bits(acc, nbits):
+    # The nbits bits left in acc after the last code, padded with zeros to
+    # whole bytes; the header records the exact length
+    extra_padding = -nbits % 8
+    return (acc << extra_padding).to_bytes((nbits + extra_padding) >> 3, 'big')
+
+
+def encode_numpy(codebook, data, output, acc=0, nbits=0):
+    code_values, code_lengths = codebook.numpy_codes
+    for start in range(0, len(data), NUMPY_CHUNK_SIZE):
+        symbols = np.frombuffer(data[start:start + NUMPY_CHUNK_SIZE], dtype=np.uint8)
+        acc, nbits = pack_codes(code_values[symbols], code_lengths[symbols], output, acc, nbits)
+    return acc, nbits
+
+
+def pack_codes(chunk_values, chunk_lengths, output, acc=0, nbits=0):
+    # Append a non-empty array of codes (values and lengths, each at most 64
+    # bits) to output after the nbits bits in acc
+    if nbits >= 8:
+        acc, nbits = write_whole_bytes(acc, nbits, output)
+
+    # Bit offset of every code, after the bits carried over from the
+    # previous chunk
+    ends = np.cumsum(chunk_lengths) + nbits
+    offsets = ends - chunk_lengths
+    total_bits = int(ends[-1])
+    words = np.zeros(((total_bits + 63) >> 6) + 1, dtype=np.uint64)
+
+    # Align each code inside its 64-bit word; codes that cross a word
+    # boundary keep their high bits here and spill the rest below
+    word_index = offsets >> 6
+    shift = 64 - (offsets & 63) - chunk_lengths
+    crossing = shift < 0
+    left = np.where(crossing, 0, shift).astype(np.uint64)
+    right = np.where(crossing, -shift, 0).astype(np.uint64)
+    aligned = (chunk_values << left) >> right
+
+    # Codes never overlap, so OR-ing everything that lands in a word builds
+    # it up
+    firsts = np.flatnonzero(np.diff(word_index, prepend=-1))
+    words[word_index[firsts]] = np.bitwise_or.reduceat(aligned, firsts)
+    spill = np.flatnonzero(crossing)
+    words[word_index[spill] + 1] |= chunk_values[spill] << (np.uint64(64) - right[spill])
+    if nbits:
+        words[0] |= np.uint64(acc << (64 - nbits))
+
+    packed = words.byteswap().view(np.uint8)
+    full_bytes = total_bits >> 3
+    output += packed[:full_bytes].tobytes()
+    nbits = total_bits & 7
+    acc = int(packed[full_bytes]) >> (8 - nbits) if nbits else 0
+    return acc, nbits
@@ -0,0 +1,171 @@
+import re
+from array import array
+from collections import Counter
+
+from canonical import read_exactly
+from container import PHRASE_COUNT
+from decoder import check_payload
+from encoder import NUMPY_CHUNK_SIZE, encode, pack_codes
+from histogram import count_contexts
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Most phrases in an extended alphabet, on top of the 256 byte values
+MAX_PHRASES = 256
+
+# Longest phrase; longer words are coded as several symbols
+MAX_PHRASE_LENGTH = 16
+
+# Phrases seen fewer times than this are not worth an entry in the table
+MIN_PHRASE_COUNT = 4
+
+# Candidate words: a letter, then letters, digits, '_' or ':', together
+# with the space or XML tag opening in front of them
+WORD = re.compile(rb'(?: |</?)?[A-Za-z][A-Za-z0-9_:]+')
+
+# Input bytes tokenised per step
+TOKENIZE_CHUNK_SIZE = 1 << 20
+
+
+def count_phrases(data):
+    # How often each candidate word occurs, and the order-1 histograms,
+    # which count every byte pair
+    return Counter(WORD.findall(data)), count_contexts(data)
+
+
+def choose_phrases(word_counts, pair_counts, max_phrases=MAX_PHRASES):
+    # Greedy choice by symbols saved: a phrase of n bytes seen c times
+    # saves c * (n - 1) symbols. Pairs are only credited with the times they
+    # occur outside the words already chosen.
+    words = sorted(((count * (len(word) - 1), word) for word, count in word_counts.items()
+                    if count >= MIN_PHRASE_COUNT and 2 < len(word) <= MAX_PHRASE_LENGTH), reverse=True)[:max_phrases]
+    pair_counts = [list(row) for row in pair_counts]
+    for saving, word in words:
+        for first, second in zip(word, word[1:]):
+            pair_counts[first][second] -= word_counts[word]
+    pairs = [(count, bytes((first, second))) for first, row in enumerate(pair_counts)
+             for second, count in enumerate(row) if count >= MIN_PHRASE_COUNT]
+    return [phrase for saving, phrase in sorted(words + pairs, reverse=True)[:max_phrases]]
+
+
+def prefix_tree(phrases):
+    # Alternation of the phrases nested by shared prefix, e.g. b'ab', b'abc'
+    # and b'ad' become a(?:b(?:c)?|d). Each branch starts with a different
+    # byte and optional tails are greedy, so the longest phrase wins.
+    branches = {}
+    for phrase in phrases:
+        branches.setdefault(phrase[:1], []).append(phrase[1:])
+    alternatives = []
+    for first, tails in sorted(branches.items()):
+        alternative = re.escape(first)
+        longer = [tail for tail in tails if tail]
+        if longer:
+            alternative += b'(?:' + prefix_tree(longer) + b')' + (b'?' if len(longer) < len(tails) else b'')
+        alternatives.append(alternative)
+    return b'|'.join(alternatives)
+
+
+class ExtendedAlphabet:
+    # The 256 byte values followed by up to MAX_PHRASES multi-byte phrases.
+    # Data is cut into the longest phrase at each position, or a single byte
+    # where none matches, so a decoded symbol can stand for several bytes.
+    # Nothing changes after construction.
+    __slots__ = ('phrases', 'symbols', 'size', 'longest')
+
+    def __init__(self, phrases):
+        phrases = tuple(phrases)
+        symbols = tuple(bytes((byte,)) for byte in range(256)) + phrases
+        set_field = super().__setattr__
+        set_field('phrases', phrases)
+        set_field('symbols', symbols)
+        set_field('size', len(symbols))
+        set_field('longest', max(len(symbol) for symbol in symbols))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ExtendedAlphabet is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ExtendedAlphabet is immutable")
+
+    @classmethod
+    def from_data(cls, data, max_phrases=MAX_PHRASES):
+        return cls(choose_phrases(*count_phrases(data), max_phrases))
+
+    @classmethod
+    def read(cls, file):
+        phrases = []
+        for _ in range(PHRASE_COUNT.unpack(read_exactly(file, PHRASE_COUNT.size))[0]):
+            length = read_exactly(file, 1)[0]
+            if length < 2:
+                raise ValueError("Corrupt phrase table")
+            phrases.append(read_exactly(file, length))
+        return cls(phrases)
+
+    @property
+    def table(self):
+        return PHRASE_COUNT.pack(len(self.phrases)) + b''.join(
+            bytes((len(phrase),)) + phrase for phrase in self.phrases)
+
+    def tokenize(self, data):
+        # The symbols of data as an array of 16-bit numbers. Chunks are cut
+        # without regard to phrases, which at worst splits one phrase per
+        # chunk into shorter symbols. The regex engine branches a byte at a
+        # time through the prefix tree, which is several times faster than
+        # trying each phrase in turn.
+        pattern = re.compile(b'(?:' + prefix_tree(self.phrases) + b')|.' if self.phrases else b'.', re.DOTALL)
+        symbol_of = {symbol: number for number, symbol in enumerate(self.symbols)}
+        symbols = array('H')
+        for start in range(0, len(data), TOKENIZE_CHUNK_SIZE):
+            tokens = pattern.findall(data[start:start + TOKENIZE_CHUNK_SIZE])
+            symbols.extend(map(symbol_of.__getitem__, tokens))
+        return symbols
+
+
+def encode_symbols(codebook, symbols, output, acc=0, nbits=0, use_numpy=True):
+    # encoder.encode for an array of symbols from tokenize
+    if not (use_numpy and codebook.numpy_codes is not None):
+        return encode(codebook, symbols, output, acc, nbits, use_numpy=False)
+    code_values, code_lengths = codebook.numpy_codes
+    symbols = np.frombuffer(symbols, dtype=np.uint16)
+    for start in range(0, len(symbols), NUMPY_CHUNK_SIZE):
+        chunk = symbols[start:start + NUMPY_CHUNK_SIZE]
+        acc, nbits = pack_codes(code_values[chunk], code_lengths[chunk], output, acc, nbits)
+    return acc, nbits
+
+
+def decode_phrases(output, data, position, acc, nbits, size, alphabet, decode_table, end=None):
+    # decoder.decode_symbols for an extended alphabet: append the bytes of
+    # each decoded symbol to output until it holds at least size bytes. The
+    # last phrase may run past size. Returns the state to carry on from.
+    # Each round decodes as many symbols as cannot overshoot, even if all
+    # were the longest phrase, which keeps the length check out of the
+    # inner loop.
+    symbols = alphabet.symbols
+    table = decode_table.table
+    subtables = decode_table.subtables
+    bits = decode_table.bits
+    mask = (1 << bits) - 1
+    symbol_bits = decode_table.symbol_bits
+    symbol_mask = (1 << symbol_bits) - 1
+    max_length = decode_table.max_length
+    refill_bytes = decode_table.refill_bytes
+    refill_bits = refill_bytes * 8
+    longest = alphabet.longest
+    while len(output) < size:
+        for _ in range(max(1, (size - len(output)) // longest)):
+            if nbits < max_length:
+                acc = ((acc & ((1 << nbits) - 1)) << refill_bits) | int.from_bytes(
+                    data[position:position + refill_bytes], 'big')
+                position += refill_bytes
+                nbits += refill_bits
+            entry = table[(acc >> (nbits - bits)) & mask]
+            if entry < 0:
+                sub_bits, subtable = subtables[~entry]
+                entry = subtable[(acc >> (nbits - bits - sub_bits)) & ((1 << sub_bits) - 1)]
+            output += symbols[entry & symbol_mask]
+            nbits -= entry >> symbol_bits
+        check_payload(position, nbits, end)
+    return position, acc, nbits
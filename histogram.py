@@ -0,0 +1,102 @@
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bytes read per step when counting a file
+CHUNK_SIZE = 1 << 20
+
+
+def empty_histogram():
+    return [0] * 256
+
+
+def update_histogram(counts, data):
+    # Add the byte counts of data to a 256-slot histogram in place
+    if not data:
+        return counts
+    if np is not None:
+        # bincount copies its input into machine-word integers, so count a
+        # chunk at a time to keep that copy small for large (mapped) inputs
+        symbols = np.frombuffer(data, dtype=np.uint8)
+        chunk_counts = np.zeros(256, dtype=np.int64)
+        for start in range(0, len(symbols), CHUNK_SIZE):
+            chunk_counts += np.bincount(symbols[start:start + CHUNK_SIZE], minlength=256)
+        for byte, count in enumerate(chunk_counts.tolist()):
+            counts[byte] += count
+    else:
+        # Counter counts in C, which is several times faster than 256
+        # separate bytes.count scans
+        for byte, count in Counter(data).items():
+            counts[byte] += count
+    return counts
+
+
+def count_bytes(data):
+    return update_histogram(empty_histogram(), data)
+
+
+def count_contexts(data, previous=0):
+    # Order-1 histograms: counts[context][byte] is how often byte follows
+    # the byte context. The first byte follows previous.
+    counts = [empty_histogram() for _ in range(256)]
+    if not data:
+        return counts
+    if np is not None:
+        symbols = np.frombuffer(data, dtype=np.uint8)
+        pair_counts = np.zeros(256 * 256, dtype=np.int64)
+        for start in range(0, len(symbols), CHUNK_SIZE):
+            chunk = symbols[start:start + CHUNK_SIZE].astype(np.int64)
+            contexts = np.empty_like(chunk)
+            contexts[0] = symbols[start - 1] if start else previous
+            contexts[1:] = chunk[:-1]
+            pair_counts += np.bincount((contexts << 8) | chunk, minlength=256 * 256)
+        return [row.tolist() for row in pair_counts.reshape(256, 256)]
+    for (context, byte), count in Counter(zip(bytes((previous,)) + bytes(data[:-1]), data)).items():
+        counts[context][byte] += count
+    return counts
+
+
+def count_symbols(symbols, symbol_count):
+    # Histogram of an array('H') of symbols from an alphabet of symbol_count
+    counts = [0] * symbol_count
+    if np is not None:
+        symbols = np.frombuffer(symbols, dtype=np.uint16)
+        for start in range(0, len(symbols), CHUNK_SIZE):
+            for symbol, count in enumerate(np.bincount(symbols[start:start + CHUNK_SIZE],
+                                                       minlength=symbol_count).tolist()):
+                counts[symbol] += count
+    else:
+        for symbol, count in Counter(symbols).items():
+            counts[symbol] += count
+    return counts
+
+
+def histogram_from_chunks(chunks):
+    counts = empty_histogram()
+    for chunk in chunks:
+        update_histogram(counts, chunk)
+    return counts
+
+
+def read_chunks(input_file, chunk_size=CHUNK_SIZE):
+    with open(input_file, 'rb') as file:
+        chunk = file.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = file.read(chunk_size)
+
+
+def histogram_from_file(input_file, chunk_size=CHUNK_SIZE):
+    return histogram_from_chunks(read_chunks(input_file, chunk_size))
+
+
+def merge_histograms(histograms):
+    # Combine partial histograms, e.g. one per worker
+    counts = empty_histogram()
+    for histogram in histograms:
+        for byte in range(256):
+            counts[byte] += histogram[byte]
+    return counts
@@ -1,123 +1,880 @@
-import heapq
+import io
+import mmap
 import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 
+from adaptive import AdaptiveHuffmanCoding
+from canonical import MAX_CODE_LENGTH, MAX_TABLE_SIZE, read_code_lengths, read_exactly
+from code_lengths import encoded_bits, huffman_code_lengths, limited_code_lengths
+from codebook import Codebook, codebook_cache
+from context_model import ContextModel, decode_context_symbols, encode_context
+from container import (ADAPTIVE, BLOCK_HEADER, BLOCK_LAYOUT, BLOCKS, CONTEXT, EXTENDED, HEADER, INTERLEAVED,
+                       INTERLEAVED_STREAMS, SEGMENT_HEADER, SINGLE_TABLE, SPLIT, STATIC, STATIC_TABLE_ID, STREAM_COUNT,
+                       BlockIndexEntry, block_index_size, check_length, checksum, pack_block_header, pack_block_index,
+                       pack_header, pack_segment_header, read_block_header, read_block_index, read_header,
+                       read_segment_header, replace_when_done, verify, verify_checksum)
+from decoder import (CHUNK_SIZE, decode, decode_interleaved, decode_interleaved_stream, decode_into, decode_stream,
+                     read_payload, read_streams, remaining_size)
+from encoder import encode, flush_bits
+from extended_alphabet import ExtendedAlphabet, decode_phrases, encode_symbols
+from histogram import count_bytes, count_contexts, count_symbols, empty_histogram, read_chunks, update_histogram
+from splitting import UNIT_SIZE, estimated_bits, find_segments
+from static_tables import static_codebook, table_for_file
 
-class HuffmanNode:
-    def __init__(self, char, freq):
-        self.char = char
-        self.freq = freq
-        self.left = None
-        self.right = None
+# Files larger than this are compressed in two streaming passes, reading
+# this many bytes at a time
+BUFFER_SIZE = 1 << 24
 
-    def __lt__(self, other):
-        return self.freq < other.freq
+# Bytes encoded per step when compressing a memory-mapped file
+MAPPED_CHUNK_SIZE = 1 << 20
+
+# Bytes from the start of a file used to judge whether a static table is
+# good enough for it
+STATIC_SAMPLE_SIZE = 1 << 16
+
+# The extended alphabet is only used when it looks at most this fraction of
+# the size of coding bytes: mostly single-byte symbols decode more slowly
+EXTENDED_MAX_RATIO = 0.98
+
+# Likewise for context-modelled tables, which take a table lookup per byte
+# more to decode than a single table
+CONTEXT_MAX_RATIO = 0.98
+
+
+class InlineExecutor:
+    # Stand-in for ProcessPoolExecutor that runs each call straight away,
+    # used when there is a single worker
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, function, *args):
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
 
 
 class HuffmanCoding:
-    def __init__(self):
-        self.heap = []
-        self.codes = {}
-        self.reverse_codes = {}
+    def __init__(self, use_numpy=True, max_code_length=None, buffer_size=BUFFER_SIZE,
+                 block_size=None, workers=None, split_tables=False, interleaved=False, static_ratio=None,
+                 use_cache=False, use_mmap=True, context_model=False, extended_alphabet=False):
+        # Only settings are kept on the instance; codes live in Codebook
+        # objects passed from call to call, so one instance can serve any
+        # number of threads at once
+        if max_code_length is not None and not 8 <= max_code_length <= MAX_CODE_LENGTH:
+            # Below 8 bits the 256 byte values cannot all have codes; codes
+            # are never longer than MAX_CODE_LENGTH anyway
+            raise ValueError("Invalid max_code_length: {!r}".format(max_code_length))
+        self.use_numpy = use_numpy
+        self.max_code_length = max_code_length
+        self.buffer_size = buffer_size
+        # With a block_size, files are split into independently coded blocks
+        # that are compressed on a pool of worker processes
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        # With split_tables, the file is cut into segments wherever the byte
+        # statistics change enough to pay for a new code table
+        self.split_tables = split_tables
+        # With interleaved, the payload is split into STREAM_COUNT streams
+        # sharing one table, which decode faster than a single stream
+        self.interleaved = interleaved
+        # With a static_ratio, a file whose type has a shipped static table
+        # is coded with it, without a frequency pass or a stored table, as
+        # long as that looks at most static_ratio times the size of coding it
+        # with its own table
+        self.static_ratio = static_ratio
+        # With use_cache, codebooks come from the process-wide cache, so
+        # files with similar byte statistics share one instead of each
+        # building its own
+        self.use_cache = use_cache
+        # With use_mmap, single-table files are read and written through
+        # memory maps instead of being copied into Python objects
+        self.use_mmap = use_mmap
+        # With context_model, each byte is coded with a table chosen by the
+        # byte before it, which suits text
+        self.context_model = context_model
+        # With extended_alphabet, frequent byte pairs and words become
+        # symbols of their own, so one code can stand for several bytes
+        self.extended_alphabet = extended_alphabet
 
     def calculate_frequencies(self, data):
-        frequency = {}
-        for byte in data:
-            frequency[byte] = frequency.get(byte, 0) + 1
-        return frequency
-
-    def build_heap(self, frequency):
-        for char, freq in frequency.items():
-            node = HuffmanNode(char, freq)
-            heapq.heappush(self.heap, node)
-
-    def build_tree(self):
-        while len(self.heap) > 1:
-            node1 = heapq.heappop(self.heap)
-            node2 = heapq.heappop(self.heap)
-            merged = HuffmanNode(None, node1.freq + node2.freq)
-            merged.left = node1
-            merged.right = node2
-            heapq.heappush(self.heap, merged)
-        return self.heap[0]
-
-    def make_codes_helper(self, root, current_code):
-        if root is None:
-            return
-        if root.char is not None:
-            self.codes[root.char] = current_code
-            self.reverse_codes[current_code] = root.char
-        self.make_codes_helper(root.left, current_code + "0")
-        self.make_codes_helper(root.right, current_code + "1")
+        return count_bytes(data)
 
-    def make_codes(self):
-        root = self.build_tree()
-        self.make_codes_helper(root, "")
+    def make_codes(self, frequency):
+        # Code lengths straight from the histogram, then canonical codes
+        if self.use_cache:
+            return codebook_cache.from_frequencies(frequency, self.max_code_length)
+        return Codebook.from_frequencies(frequency, self.max_code_length)
 
-    def compress(self, input_file):
-        with open(input_file, 'rb') as file:
-            data = file.read()
+    def encode(self, codebook, data, output, acc=0, nbits=0):
+        # acc holds nbits bits left over from a previous call
+        return encode(codebook, data, output, acc, nbits, self.use_numpy)
 
+    def compress_data(self, data, output):
         # Calculate frequencies
         frequency = self.calculate_frequencies(data)
-        self.build_heap(frequency)
-        self.make_codes()
+        codebook = self.make_codes(frequency)
+
+        # Encode the data straight into packed bytes, after the code-length
+        # table
+        output += codebook.table
+        acc, nbits = self.encode(codebook, data, output)
+
+        # Pad the last byte with zeros; the header records the exact length
+        output += flush_bits(acc, nbits)
+        return output
+
+    def compress_interleaved_data(self, data, output):
+        frequency = self.calculate_frequencies(data)
+        codebook = self.make_codes(frequency)
+        output += codebook.table
 
-        # Encode the data
-        encoded_data = ''.join([self.codes[byte] for byte in data])
+        # Every stream is padded to a whole byte on its own
+        streams = []
+        for number in range(STREAM_COUNT):
+            stream = bytearray()
+            acc, nbits = self.encode(codebook, data[number::STREAM_COUNT], stream)
+            stream += flush_bits(acc, nbits)
+            streams.append(stream)
+        output += INTERLEAVED_STREAMS.pack(*(len(stream) for stream in streams))
+        for stream in streams:
+            output += stream
+        return output
 
-        # Add padding to ensure it aligns to a byte boundary
-        extra_padding = 8 - len(encoded_data) % 8
-        encoded_data += '0' * extra_padding
-        padded_info = "{0:08b}".format(extra_padding)
-        encoded_data = padded_info + encoded_data
+    def compress_bytes(self, data):
+        # Compress any buffer-protocol object (bytes, bytearray, memoryview,
+        # mmap, ...) without copying it, and return the .huff data as a
+        # bytearray. The result always uses the single-table layout.
+        with memoryview(data) as view, view.cast('B') as data:
+            output = bytearray(pack_header(SINGLE_TABLE, self.max_code_length, len(data), checksum(data)))
+            return self.compress_data(data, output)
 
-        # Convert to bytes
-        byte_array = bytearray()
-        for i in range(0, len(encoded_data), 8):
-            byte = encoded_data[i:i + 8]
-            byte_array.append(int(byte, 2))
+    def decompress_bytes(self, data):
+        # Decompress .huff data of any layout from any buffer-protocol
+        # object and return the original data as a bytearray. Single-table,
+        # static-table and block data are decoded straight from the buffer;
+        # the other layouts are read from a copy as from a file.
+        with memoryview(data) as view, view.cast('B') as data:
+            file = io.BytesIO(data[:HEADER.size + MAX_TABLE_SIZE])
+            header = read_header(file)
+            if header.layout == BLOCKS:
+                output = self.decompress_blocks_bytes(data, header)
+            elif header.layout in (SINGLE_TABLE, STATIC):
+                decode_table = self.read_codebook(file, header).decode_table
+                check_length(header.original_length, len(data) - file.tell())
+                output = bytearray(header.original_length)
+                decode_into(output, data, file.tell(), decode_table)
+            else:
+                file = io.BytesIO(data)
+                file.seek(HEADER.size)
+                output = bytearray()
+                for chunk in self.decompress_chunks(file, header):
+                    output += chunk
+                return output
+        verify(header, output)
+        return output
+
+    def decompress_blocks_bytes(self, data, header):
+        # Block-layout data in a buffer, found through its index and decoded
+        # block by block; the caller checks the whole-file CRC
+        layout = data[HEADER.size:HEADER.size + BLOCK_LAYOUT.size]
+        block_count = BLOCK_LAYOUT.unpack(read_exactly(io.BytesIO(layout), BLOCK_LAYOUT.size))[1]
+        file = io.BytesIO(data[:HEADER.size + block_index_size(block_count)])
+        file.seek(HEADER.size)
+        index = read_block_index(file, header.original_length, len(data))[1]
+        output = bytearray()
+        for entry in index:
+            block_header = read_block_header(io.BytesIO(data[entry.offset:entry.offset + BLOCK_HEADER.size]), entry)
+            start = entry.offset + BLOCK_HEADER.size
+            block = data[start:start + block_header.compressed_size]
+            if len(block) != block_header.compressed_size:
+                raise ValueError("Truncated .huff block")
+            output += decompress_block(block, block_header.original_size, block_header.checksum)
+        return output
+
+    def compress(self, input_file):
+        if self.block_size:
+            return self.compress_blocks(input_file)
+        if self.split_tables:
+            return self.compress_split(input_file)
+        if self.context_model:
+            return self.compress_context(input_file)
+        if self.extended_alphabet:
+            return self.compress_extended(input_file)
+        if self.static_ratio:
+            table_id = self.choose_static_table(input_file)
+            if table_id is not None:
+                return self.compress_static(input_file, table_id)
+        # The interleaved streams follow one another in the file, so they are
+        # always coded in memory
+        if self.use_mmap and not self.interleaved and os.path.getsize(input_file):
+            return self.compress_mapped(input_file)
+        if self.buffer_size and os.path.getsize(input_file) > self.buffer_size and not self.interleaved:
+            return self.compress_stream(input_file)
+
+        with open(input_file, 'rb') as file:
+            data = file.read()
+
+        if self.interleaved:
+            byte_array = bytearray(pack_header(INTERLEAVED, self.max_code_length, len(data), checksum(data)))
+            self.compress_interleaved_data(data, byte_array)
+        else:
+            byte_array = bytearray(pack_header(SINGLE_TABLE, self.max_code_length, len(data), checksum(data)))
+            self.compress_data(data, byte_array)
 
         # Write the compressed data to a new file
         compressed_file = input_file + ".huff"
         with open(compressed_file, 'wb') as file:
             file.write(byte_array)
 
-        # Save the frequency map for decompression
-        freq_file = input_file + ".freq"
-        with open(freq_file, 'w') as freq_file:
-            freq_file.write(str(frequency))
+        return compressed_file
+
+    def compress_context(self, input_file):
+        with open(input_file, 'rb') as file:
+            data = file.read()
+
+        # Both codes are known up front, so their sizes are compared exactly
+        # and data the order-1 tables do not pay for gets a single-table file
+        context_histograms = count_contexts(data)
+        model = ContextModel.from_contexts(context_histograms, self.max_code_length)
+        context_bits = 8 * len(model.table) + sum(
+            encoded_bits(histogram, model.codebooks[table].lengths)
+            for histogram, table in zip(context_histograms, model.context_map))
+        frequency = self.calculate_frequencies(data)
+        codebook = self.make_codes(frequency)
+        single_bits = 8 * len(codebook.table) + encoded_bits(frequency, codebook.lengths)
+        if context_bits > CONTEXT_MAX_RATIO * single_bits:
+            output = bytearray(pack_header(SINGLE_TABLE, self.max_code_length, len(data), checksum(data)))
+            output += codebook.table
+            acc, nbits = self.encode(codebook, data, output)
+        else:
+            output = bytearray(pack_header(CONTEXT, self.max_code_length, len(data), checksum(data)))
+            output += model.table
+            acc, nbits = encode_context(model, data, output, use_numpy=self.use_numpy)
+        output += flush_bits(acc, nbits)
+
+        compressed_file = input_file + ".huff"
+        with open(compressed_file, 'wb') as file:
+            file.write(output)
+
+        return compressed_file
+
+    def compress_extended(self, input_file):
+        with open(input_file, 'rb') as file:
+            data = file.read()
+
+        alphabet = ExtendedAlphabet.from_data(data)
+        symbols = alphabet.tokenize(data)
+        frequency = count_symbols(symbols, alphabet.size)
+        # Data where the phrases save too little, or that uses more symbols
+        # than max_code_length allows, gets a single-table file
+        extended_bits = estimated_bits(frequency) + 8 * len(alphabet.table)
+        too_many = self.max_code_length and sum(1 for count in frequency if count) > 1 << self.max_code_length
+        if too_many or extended_bits > EXTENDED_MAX_RATIO * estimated_bits(count_bytes(data)):
+            output = bytearray(pack_header(SINGLE_TABLE, self.max_code_length, len(data), checksum(data)))
+            self.compress_data(data, output)
+        else:
+            codebook = self.make_codes(frequency)
+            output = bytearray(pack_header(EXTENDED, self.max_code_length, len(data), checksum(data)))
+            output += alphabet.table
+            output += codebook.table
+            acc, nbits = encode_symbols(codebook, symbols, output, use_numpy=self.use_numpy)
+            output += flush_bits(acc, nbits)
+
+        compressed_file = input_file + ".huff"
+        with open(compressed_file, 'wb') as file:
+            file.write(output)
+
+        return compressed_file
+
+    def compress_mapped(self, input_file):
+        # Both passes read the input's pages straight from the page cache.
+        # The histogram gives the exact compressed size, so the output is
+        # preallocated and mapped too, and the codes are written into it a
+        # chunk at a time.
+        compressed_file = input_file + ".huff"
+        with open(input_file, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as data:
+                frequency = self.calculate_frequencies(data)
+                codebook = self.make_codes(frequency)
+                payload_size = (encoded_bits(frequency, codebook.lengths) + 7) // 8
+                compressed_size = HEADER.size + len(codebook.table) + payload_size
+
+                with open(compressed_file, 'w+b') as output_file:
+                    output_file.truncate(compressed_size)
+                    with mmap.mmap(output_file.fileno(), compressed_size) as output:
+                        output.write(pack_header(SINGLE_TABLE, self.max_code_length, len(data), checksum(data)))
+                        output.write(codebook.table)
+                        acc = 0
+                        nbits = 0
+                        for start in range(0, len(data), MAPPED_CHUNK_SIZE):
+                            encoded = bytearray()
+                            acc, nbits = self.encode(codebook, data[start:start + MAPPED_CHUNK_SIZE], encoded, acc,
+                                                     nbits)
+                            output.write(encoded)
+                        output.write(flush_bits(acc, nbits))
 
         return compressed_file
 
+    def choose_static_table(self, input_file):
+        # Compare the static table with a file-specific one on a sample from
+        # the start of the file, scaled up to the whole file. The file's own
+        # table also has to be stored, which is what tips small files.
+        table_id = table_for_file(input_file)
+        if table_id is None:
+            return None
+        codebook = static_codebook(table_id)
+        if self.max_code_length and codebook.max_length > self.max_code_length:
+            return None
+        with open(input_file, 'rb') as file:
+            sample = file.read(STATIC_SAMPLE_SIZE)
+        if not sample:
+            return table_id
+        frequency = self.calculate_frequencies(sample)
+        optimal = self.make_codes(frequency)
+        scale = os.path.getsize(input_file) / len(sample)
+        static_bits = encoded_bits(frequency, codebook.lengths) * scale
+        optimal_bits = encoded_bits(frequency, optimal.lengths) * scale + 8 * len(optimal.table)
+        return table_id if static_bits <= self.static_ratio * optimal_bits else None
+
+    def compress_static(self, input_file, table_id):
+        # A single pass: the length and checksum are only known at the end,
+        # so the header is written again then
+        codebook = static_codebook(table_id)
+        compressed_file = input_file + ".huff"
+        with open(compressed_file, 'wb') as file:
+            file.write(pack_header(STATIC, self.max_code_length, 0, 0))
+            file.write(STATIC_TABLE_ID.pack(table_id))
+            crc = 0
+            original_length = 0
+            acc = 0
+            nbits = 0
+            for chunk in read_chunks(input_file, self.buffer_size or BUFFER_SIZE):
+                crc = checksum(chunk, crc)
+                original_length += len(chunk)
+                output = bytearray()
+                acc, nbits = self.encode(codebook, chunk, output, acc, nbits)
+                file.write(output)
+
+            file.write(flush_bits(acc, nbits))
+            file.seek(0)
+            file.write(pack_header(STATIC, self.max_code_length, original_length, crc))
+
+        return compressed_file
+
+    def compress_stream(self, input_file):
+        # First pass: histogram, length and checksum, one buffer at a time
+        frequency = empty_histogram()
+        crc = 0
+        original_length = 0
+        for chunk in read_chunks(input_file, self.buffer_size):
+            update_histogram(frequency, chunk)
+            crc = checksum(chunk, crc)
+            original_length += len(chunk)
+        codebook = self.make_codes(frequency)
+
+        # Second pass: encode each buffer and write it out straight away, so
+        # memory use depends on buffer_size and not on the file size
+        compressed_file = input_file + ".huff"
+        with open(compressed_file, 'wb') as file:
+            file.write(pack_header(SINGLE_TABLE, self.max_code_length, original_length, crc))
+            file.write(codebook.table)
+            acc = 0
+            nbits = 0
+            for chunk in read_chunks(input_file, self.buffer_size):
+                output = bytearray()
+                acc, nbits = self.encode(codebook, chunk, output, acc, nbits)
+                file.write(output)
+
+            file.write(flush_bits(acc, nbits))
+
+        return compressed_file
+
+    def compress_split(self, input_file):
+        # The units are read twice, once for their histograms and once to
+        # code them, but a segment is coded as soon as find_segments closes
+        # it, so memory does not grow with the file. Each segment is coded
+        # with its own table, or with the previous one when that is no bigger
+        # than a new table and its codes.
+        unit_histograms = (count_bytes(unit) for unit in read_chunks(input_file, UNIT_SIZE))
+        compressed_file = input_file + ".huff"
+        with open(compressed_file, 'wb') as file:
+            # The length and checksum are only known at the end, so the
+            # header is written again then
+            file.write(pack_header(SPLIT, self.max_code_length, 0, 0))
+            crc = 0
+            original_length = 0
+            units = read_chunks(input_file, UNIT_SIZE)
+            previous = None
+            for unit_count, frequency in find_segments(unit_histograms):
+                codebook = self.make_codes(frequency)
+                table = codebook.table
+                if previous and previous.covers(frequency) and encoded_bits(frequency, previous.lengths) <= \
+                        encoded_bits(frequency, codebook.lengths) + 8 * len(table):
+                    codebook = previous
+                    table = b''
+                else:
+                    previous = codebook
+
+                # The payload size is only known once the segment is coded,
+                # so its header is written again afterwards
+                header_position = file.tell()
+                file.write(bytes(SEGMENT_HEADER.size))
+                file.write(table)
+                original_size = 0
+                payload_size = 0
+                acc = 0
+                nbits = 0
+                for _ in range(unit_count):
+                    unit = next(units)
+                    output = bytearray()
+                    acc, nbits = self.encode(codebook, unit, output, acc, nbits)
+                    file.write(output)
+                    crc = checksum(unit, crc)
+                    original_size += len(unit)
+                    payload_size += len(output)
+                padded = flush_bits(acc, nbits)
+                file.write(padded)
+                payload_size += len(padded)
+
+                end = file.tell()
+                file.seek(header_position)
+                file.write(pack_segment_header(original_size, payload_size, table))
+                file.seek(end)
+                original_length += original_size
+
+            file.seek(0)
+            file.write(pack_header(SPLIT, self.max_code_length, original_length, crc))
+
+        return compressed_file
+
+    def read_segments(self, file, header):
+        # Yield (segment header, codebook) for each segment in turn, with
+        # the file positioned at the segment's payload. Afterwards the file is
+        # moved past the payload, wherever the caller left it.
+        codebook = None
+        remaining = header.original_length
+        while remaining:
+            segment_header = read_segment_header(file)
+            if segment_header.new_table:
+                codebook = self.read_codebook(file)
+            elif codebook is None:
+                raise ValueError("First .huff segment has no code table")
+            if not 0 < segment_header.original_size <= remaining:
+                raise ValueError("Segment sizes do not match the .huff header")
+            check_length(segment_header.original_size, segment_header.payload_size)
+            payload_end = file.tell() + segment_header.payload_size
+            yield segment_header, codebook
+            file.seek(payload_end)
+            remaining -= segment_header.original_size
+
+    def decompress_mapped(self, file, header, decompressed_file):
+        # Decode from the memory-mapped .huff file straight into the
+        # preallocated and memory-mapped output
+        decode_table = self.read_codebook(file, header).decode_table
+        payload_start = file.tell()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+                open(decompressed_file, 'w+b') as output_file:
+            check_length(header.original_length, len(data) - payload_start)
+            output_file.truncate(header.original_length)
+            with mmap.mmap(output_file.fileno(), header.original_length) as output:
+                decode_into(output, data, payload_start, decode_table)
+                crc = checksum(output)
+        verify_checksum(header, header.original_length, crc)
+
+    def read_codebook(self, file, header=None):
+        # The code table stored in the file, or the static table it names
+        if header is not None and header.layout == STATIC:
+            return static_codebook(STATIC_TABLE_ID.unpack(read_exactly(file, STATIC_TABLE_ID.size))[0])
+        if self.use_cache:
+            return codebook_cache.read(file)
+        return Codebook.read(file)
+
+    def read_interleaved(self, file, header):
+        # The decode table and the padded streams of an interleaved file
+        decode_table = self.read_codebook(file).decode_table
+        sizes = INTERLEAVED_STREAMS.unpack(read_exactly(file, INTERLEAVED_STREAMS.size))
+        check_length(header.original_length, sum(sizes))
+        return decode_table, read_streams(file, sizes, decode_table)
+
+    def read_context(self, file, header):
+        # The context model and padded payload of a context-layout file
+        model = ContextModel.read(file)
+        payload_size = remaining_size(file)
+        check_length(header.original_length, payload_size)
+        return model, read_payload(file, payload_size, model)
+
+    def read_extended(self, file, header):
+        # The alphabet, decode table and padded payload of an extended-layout
+        # file
+        alphabet = ExtendedAlphabet.read(file)
+        lengths = read_code_lengths(file, alphabet.size)
+        codebook = codebook_cache.from_lengths(lengths) if self.use_cache else Codebook(lengths)
+        payload_size = remaining_size(file)
+        check_length(header.original_length, payload_size, alphabet.longest)
+        return alphabet, codebook.decode_table, read_payload(file, payload_size, codebook.decode_table)
+
+    def block_pool(self):
+        if self.workers == 1:
+            return InlineExecutor()
+        return ProcessPoolExecutor(self.workers)
+
+    def compress_blocks(self, input_file):
+        original_length = os.path.getsize(input_file)
+        block_count = -(-original_length // self.block_size)
+        compressed_file = input_file + ".huff"
+        with open(compressed_file, 'wb') as file, self.block_pool() as pool:
+            # The checksum and the block offsets are only known once every
+            # block has been written, so the header and index are written
+            # again at the end
+            file.write(pack_header(BLOCKS, self.max_code_length, original_length, 0))
+            file.write(bytes(block_index_size(block_count)))
+            index = []
+
+            def write_block(compressed):
+                original_size = BLOCK_HEADER.unpack_from(compressed)[0]
+                index.append(BlockIndexEntry(file.tell(), len(compressed), original_size))
+                file.write(compressed)
+
+            # Blocks are written in order as they finish; at most two per
+            # worker are in flight so memory stays bounded
+            crc = 0
+            pending = deque()
+            for block in read_chunks(input_file, self.block_size):
+                crc = checksum(block, crc)
+                pending.append(pool.submit(compress_block, block, self.use_numpy, self.max_code_length,
+                                           self.use_cache))
+                if len(pending) >= 2 * self.workers:
+                    write_block(pending.popleft().result())
+            while pending:
+                write_block(pending.popleft().result())
+            if len(index) != block_count:
+                raise ValueError("{} changed size while it was being compressed".format(input_file))
+
+            file.seek(0)
+            file.write(pack_header(BLOCKS, self.max_code_length, original_length, crc))
+            file.write(pack_block_index(self.block_size, index))
+
+        return compressed_file
+
+    def read_blocks(self, file, header):
+        # Yield (block header, table and payload) for each block in turn
+        block_size, index = read_block_index(file, header.original_length)
+        for entry in index:
+            file.seek(entry.offset)
+            block_header = read_block_header(file, entry)
+            yield block_header, read_exactly(file, block_header.compressed_size)
+
+    def decompress_blocks(self, file, header, decompressed_file):
+        # Every block's place in the output is known from the index, so the
+        # workers decode blocks in any order and write them straight into a
+        # preallocated output file (which decompress replaces the real one
+        # with only if every block checks out). Each block is checked against
+        # its own CRC-32, and the whole output against the header's.
+        block_size, index = read_block_index(file, header.original_length)
+        with open(decompressed_file, 'wb') as output:
+            output.truncate(header.original_length)
+        with self.block_pool() as pool:
+            futures = [pool.submit(decompress_block_into, file.name, entry, decompressed_file, number * block_size)
+                       for number, entry in enumerate(index)]
+            for future in futures:
+                future.result()
+        crc = 0
+        for chunk in read_chunks(decompressed_file, self.buffer_size or BUFFER_SIZE):
+            crc = checksum(chunk, crc)
+        verify_checksum(header, header.original_length, crc)
+
     def decompress(self, input_file):
-        # Read the compressed file
+        decompressed_file = input_file.replace('.huff', '')
         with open(input_file, 'rb') as file:
-            bit_string = ''
-            byte = file.read(1)
-            while byte:
-                byte = ord(byte)
-                bits = bin(byte)[2:].rjust(8, '0')
-                bit_string += bits
-                byte = file.read(1)
-
-        # Remove the padding
-        padded_info = bit_string[:8]
-        extra_padding = int(padded_info, 2)
-        bit_string = bit_string[8:]
-        encoded_data = bit_string[:-extra_padding]
-
-        # Decode the data
-        current_code = ''
-        decoded_bytes = bytearray()
-        for bit in encoded_data:
-            current_code += bit
-            if current_code in self.reverse_codes:
-                decoded_bytes.append(self.reverse_codes[current_code])
-                current_code = ''
+            header = read_header(file)
+            # Layouts decoded straight to disk write to a temporary file,
+            # which only replaces decompressed_file once it is verified
+            if header.layout == BLOCKS:
+                with replace_when_done(decompressed_file) as temporary:
+                    self.decompress_blocks(file, header, temporary)
+                return decompressed_file
+            if header.layout == ADAPTIVE:
+                return AdaptiveHuffmanCoding().decompress(input_file)
+            if header.layout == SPLIT:
+                crc = 0
+                with replace_when_done(decompressed_file) as temporary, open(temporary, 'wb') as output:
+                    for segment_header, codebook in self.read_segments(file, header):
+                        decode_table = codebook.decode_table
+                        payload = read_payload(file, segment_header.payload_size, decode_table)
+                        data = decode(payload, decode_table, segment_header.original_size, padded=True)
+                        crc = checksum(data, crc)
+                        output.write(data)
+                    verify_checksum(header, header.original_length, crc)
+                return decompressed_file
+            if header.layout in (SINGLE_TABLE, STATIC) and self.use_mmap and header.original_length:
+                with replace_when_done(decompressed_file) as temporary:
+                    self.decompress_mapped(file, header, temporary)
+                return decompressed_file
+
+            if header.layout == INTERLEAVED:
+                decode_table, streams = self.read_interleaved(file, header)
+                decoded_bytes = decode_interleaved(streams, decode_table, header.original_length)
+            elif header.layout == CONTEXT:
+                model, payload = self.read_context(file, header)
+                decoded_bytes = bytearray(header.original_length)
+                decode_context_symbols(decoded_bytes, payload, 0, 0, 0, 0, model, len(payload) - model.refill_bytes)
+            elif header.layout == EXTENDED:
+                alphabet, decode_table, payload = self.read_extended(file, header)
+                decoded_bytes = bytearray()
+                decode_phrases(decoded_bytes, payload, 0, 0, 0, header.original_length, alphabet, decode_table,
+                               len(payload) - decode_table.refill_bytes)
+            elif header.layout in (SINGLE_TABLE, STATIC):
+                decode_table = self.read_codebook(file, header).decode_table
+                decoded_bytes = bytearray()
+                if header.original_length:
+                    payload_size = remaining_size(file)
+                    check_length(header.original_length, payload_size)
+                    payload = read_payload(file, payload_size, decode_table)
+
+                    # Decode exactly original_length bytes; anything after
+                    # them is padding
+                    decoded_bytes = decode(payload, decode_table, header.original_length, padded=True)
+            else:
+                raise ValueError("Unsupported .huff layout: {}".format(header.layout))
+        verify(header, decoded_bytes)
 
         # Write the decompressed data to a new file
-        decompressed_file = input_file.replace('.huff', '')
-        with open(decompressed_file, 'wb') as file:
+        with replace_when_done(decompressed_file) as temporary, open(temporary, 'wb') as file:
             file.write(decoded_bytes)
 
         return decompressed_file
+
+    def decompress_stream(self, input_file, chunk_size=CHUNK_SIZE):
+        # Yield the decompressed data chunk_size bytes at a time, e.g. to a
+        # Flask streaming response, without holding all of it in memory
+        with open(input_file, 'rb') as file:
+            yield from self.decompress_chunks(file, read_header(file), chunk_size)
+
+    def decompress_chunks(self, file, header, chunk_size=CHUNK_SIZE):
+        # decompress_stream for an open file positioned just after header.
+        # The length and checksum are verified once the last chunk has been
+        # yielded.
+        if header.layout == ADAPTIVE:
+            # The length and checksum are in the trailer, which the adaptive
+            # decoder checks itself
+            yield from AdaptiveHuffmanCoding().decompress_chunks(file, chunk_size)
+            return
+        crc = 0
+        length = 0
+        for chunk in self.decode_chunks(file, header, chunk_size):
+            crc = checksum(chunk, crc)
+            length += len(chunk)
+            yield chunk
+        verify_checksum(header, length, crc)
+
+    def decode_chunks(self, file, header, chunk_size):
+        # The decoded data of every layout but ADAPTIVE, unverified
+        if header.layout == BLOCKS:
+            for block_header, block in self.read_blocks(file, header):
+                block_file = io.BytesIO(block)
+                decode_table = self.read_codebook(block_file).decode_table
+                yield from decode_stream(block_file, decode_table, block_header.original_size, chunk_size)
+        elif header.layout == SPLIT:
+            # decode_stream may read ahead into the next segment; those
+            # bytes are never decoded and read_segments seeks back
+            for segment_header, codebook in self.read_segments(file, header):
+                yield from decode_stream(file, codebook.decode_table, segment_header.original_size, chunk_size)
+        elif header.layout == INTERLEAVED:
+            decode_table, streams = self.read_interleaved(file, header)
+            yield from decode_interleaved_stream(streams, decode_table, header.original_length, chunk_size)
+        elif header.layout == CONTEXT:
+            # The payload is read whole; the output still comes a chunk at a
+            # time
+            model, payload = self.read_context(file, header)
+            payload_end = len(payload) - model.refill_bytes
+            state = (0, 0, 0, 0)
+            for start in range(0, header.original_length, chunk_size):
+                chunk = bytearray(min(chunk_size, header.original_length - start))
+                state = decode_context_symbols(chunk, payload, *state, model, payload_end)
+                yield bytes(chunk)
+        elif header.layout == EXTENDED:
+            # A phrase can run past the end of a chunk; its remaining bytes
+            # start the next one
+            alphabet, decode_table, payload = self.read_extended(file, header)
+            payload_end = len(payload) - decode_table.refill_bytes
+            decoded = bytearray()
+            state = (0, 0, 0)
+            for start in range(0, header.original_length, chunk_size):
+                size = min(chunk_size, header.original_length - start)
+                state = decode_phrases(decoded, payload, *state, size, alphabet, decode_table, payload_end)
+                chunk = bytes(decoded[:size])
+                del decoded[:size]
+                yield chunk
+        elif header.layout in (SINGLE_TABLE, STATIC):
+            codebook = self.read_codebook(file, header)
+            if header.original_length:
+                yield from decode_stream(file, codebook.decode_table, header.original_length, chunk_size)
+        else:
+            raise ValueError("Unsupported .huff layout: {}".format(header.layout))
+
+    def decompress_range(self, input_file, offset, length):
+        # Return bytes [offset, offset + length) of the original file. For
+        # block-layout files only the blocks covering the range are read and
+        # decoded, so the cost follows the range and not the file size.
+        if offset < 0 or length < 0:
+            raise ValueError("Range offset and length must not be negative")
+        with open(input_file, 'rb') as file:
+            header = read_header(file)
+            if header.layout == ADAPTIVE:
+                # The header does not record the length, so decode forwards
+                # until the range is covered or the data ends
+                parts = []
+                chunk_start = 0
+                end = offset + length
+                chunks = self.decompress_chunks(file, header)
+                for chunk in chunks:
+                    chunk_end = chunk_start + len(chunk)
+                    if chunk_end > offset:
+                        parts.append(chunk[max(offset - chunk_start, 0):end - chunk_start])
+                    if chunk_end >= end:
+                        break
+                    chunk_start = chunk_end
+                chunks.close()
+                return b''.join(parts)
+
+            end = min(offset + length, header.original_length)
+            if offset >= end:
+                return b''
+
+            if header.layout == BLOCKS:
+                block_size, index = read_block_index(file, header.original_length)
+                parts = []
+                for number in range(offset // block_size, (end - 1) // block_size + 1):
+                    block_start = number * block_size
+                    file.seek(index[number].offset)
+                    block_header = read_block_header(file, index[number])
+                    block = read_exactly(file, block_header.compressed_size)
+                    data = decompress_block(block, block_header.original_size, block_header.checksum,
+                                            min(block_header.original_size, end - block_start))
+                    parts.append(data[max(offset - block_start, 0):])
+                data = b''.join(parts)
+                if len(data) == header.original_length:
+                    verify(header, data)
+                return data
+
+            if header.layout == SPLIT:
+                # Segments before the range are skipped without decoding. If
+                # none were, and the range runs to the end, the whole file
+                # has been decoded and its checksum can be checked.
+                parts = []
+                crc = 0
+                decoded = 0
+                segment_start = 0
+                for segment_header, codebook in self.read_segments(file, header):
+                    segment_end = segment_start + segment_header.original_size
+                    if segment_end > offset:
+                        decode_table = codebook.decode_table
+                        payload = read_payload(file, segment_header.payload_size, decode_table)
+                        data = decode(payload, decode_table, min(segment_end, end) - segment_start, padded=True)
+                        crc = checksum(data, crc)
+                        decoded += len(data)
+                        parts.append(data[max(offset - segment_start, 0):])
+                    if segment_end >= end:
+                        break
+                    segment_start = segment_end
+                if decoded == header.original_length:
+                    verify_checksum(header, decoded, crc)
+                return b''.join(parts)
+
+            # Without an index everything up to the end of the range has to
+            # be decoded
+            if header.layout == INTERLEAVED:
+                decode_table, streams = self.read_interleaved(file, header)
+                data = decode_interleaved(streams, decode_table, end)
+            elif header.layout == CONTEXT:
+                model, payload = self.read_context(file, header)
+                data = bytearray(end)
+                decode_context_symbols(data, payload, 0, 0, 0, 0, model, len(payload) - model.refill_bytes)
+            elif header.layout == EXTENDED:
+                alphabet, decode_table, payload = self.read_extended(file, header)
+                data = bytearray()
+                decode_phrases(data, payload, 0, 0, 0, end, alphabet, decode_table,
+                               len(payload) - decode_table.refill_bytes)
+            elif header.layout in (SINGLE_TABLE, STATIC):
+                decode_table = self.read_codebook(file, header).decode_table
+                payload_size = remaining_size(file)
+                check_length(header.original_length, payload_size)
+                payload = read_payload(file, payload_size, decode_table)
+                data = decode(payload, decode_table, end, padded=True)
+            else:
+                raise ValueError("Unsupported .huff layout: {}".format(header.layout))
+        # A range that runs to the end has decoded the whole file
+        if end == header.original_length:
+            verify(header, data)
+        return bytes(data[offset:end])
+
+
+def compress_block(data, use_numpy=True, max_code_length=None, use_cache=False):
+    # Worker entry point: one block with its own code table. Each worker
+    # process has its own codebook cache.
+    coder = HuffmanCoding(use_numpy=use_numpy, max_code_length=max_code_length, use_cache=use_cache)
+    compressed = coder.compress_data(data, bytearray())
+    return pack_block_header(len(data), len(compressed), checksum(data)) + compressed
+
+
+def decompress_block(block, original_size, crc, count=None):
+    # Decode the first count bytes of a block (all of it by default); the
+    # checksum can only be checked when the whole block is decoded
+    if count is None:
+        count = original_size
+    block_file = io.BytesIO(block)
+    decode_table = Codebook.read(block_file).decode_table
+    check_length(original_size, len(block) - block_file.tell())
+    data = decode(memoryview(block)[block_file.tell():], decode_table, count)
+    if count == original_size and checksum(data) != crc:
+        raise ValueError("Decompressed block does not match its checksum")
+    return data
+
+
+def decompress_block_into(input_file, entry, output_file, output_offset):
+    # Worker entry point: decode the block that index entry points to in
+    # input_file and write it at output_offset in output_file
+    with open(input_file, 'rb') as file:
+        file.seek(entry.offset)
+        block_header = read_block_header(file, entry)
+        block = read_exactly(file, block_header.compressed_size)
+    data = decompress_block(block, block_header.original_size, block_header.checksum)
+    with open(output_file, 'r+b') as output:
+        output.seek(output_offset)
+        output.write(data)
+
+
+def compress_bytes(data):
+    return HuffmanCoding().compress_bytes(data)
+
+
+def decompress_bytes(data):
+    return HuffmanCoding().decompress_bytes(data)
+
+
+def decompress(input_file):
+    # Everything needed to decode is in the file itself
+    return HuffmanCoding().decompress(input_file)
+
+
+def decompress_stream(input_file, chunk_size=CHUNK_SIZE):
+    return HuffmanCoding().decompress_stream(input_file, chunk_size)
+
+
+def decompress_range(input_file, offset, length):
+    return HuffmanCoding().decompress_range(input_file, offset, length)
+
+
+def length_limit_cost(frequency, max_code_length):
+    # Extra output size from capping codes at max_code_length bits, as a
+    # fraction of the unrestricted Huffman output
+    optimal = encoded_bits(frequency, huffman_code_lengths(frequency))
+    limited = encoded_bits(frequency, limited_code_lengths(frequency, max_code_length))
+    return (limited - optimal) / optimal if optimal else 0.0
@@ -0,0 +1,257 @@
+import io
+import shutil
+import sys
+import tempfile
+
+from canonical import read_exactly
+from container import (ADAPTIVE, BLOCKS, HEADER, BlockIndexEntry, block_index_size, checksum, pack_block_index,
+                       pack_header, read_block_header, read_block_index, read_header)
+from huffman import HuffmanCoding, compress_block, decompress_block
+
+# Uncompressed bytes per block when writing
+BLOCK_SIZE = 1 << 20
+
+READ = 'rb'
+WRITE = 'wb'
+
+
+class HuffmanFile(io.BufferedIOBase):
+    # A .huff file as a binary file object, in the style of gzip.GzipFile.
+    # Reading decodes a chunk or block at a time, so code that takes file
+    # objects never needs the whole decoded data in memory; block-layout
+    # files seek through their block index and decode only the block a read
+    # lands in. Writing produces a block-layout file, compressing each block
+    # as soon as it is full.
+
+    def __init__(self, filename=None, mode='rb', fileobj=None, block_size=BLOCK_SIZE, coder=None):
+        if mode not in ('r', 'rb', 'w', 'wb'):
+            raise ValueError("Invalid mode: {!r}".format(mode))
+        self.mode = READ if mode.startswith('r') else WRITE
+        self.owns_file = fileobj is None
+        self.fileobj = open(filename, self.mode) if fileobj is None else fileobj
+        self.name = getattr(self.fileobj, 'name', filename)
+        self.coder = coder or HuffmanCoding()
+        self.position = 0
+        self.index = None
+        self.chunks = None
+
+        if self.mode == READ:
+            try:
+                self.header = read_header(self.fileobj)
+                self.start = self.fileobj.tell()
+                if self.header.layout == BLOCKS:
+                    self.block_size, self.index = read_block_index(self.fileobj, self.header.original_length)
+                else:
+                    self.chunks = self.coder.decompress_chunks(self.fileobj, self.header)
+            except Exception:
+                if self.owns_file:
+                    self.fileobj.close()
+                raise
+            # Decoded data starting at buffer_start. position may be anywhere
+            # in it, or outside it after a seek.
+            self.buffer = b''
+            self.buffer_start = 0
+        else:
+            self.block_size = block_size
+            self.pending = bytearray()
+            # Compressed blocks wait here until the index can be written in
+            # front of them
+            self.blocks = tempfile.TemporaryFile()
+            self.index = []
+            self.crc = 0
+            self.length = 0
+
+    def readable(self):
+        return self.mode == READ
+
+    def writable(self):
+        return self.mode == WRITE
+
+    def seekable(self):
+        return self.mode == READ and self.fileobj.seekable()
+
+    def tell(self):
+        self.check_not_closed()
+        return self.position
+
+    def check_not_closed(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+    def check_mode(self, mode):
+        self.check_not_closed()
+        if self.mode != mode:
+            raise io.UnsupportedOperation("File not open for {}".format("reading" if mode == READ else "writing"))
+
+    def fill_buffer(self):
+        # Make the buffer hold the byte at position; False at the end
+        if self.index is not None:
+            if self.position >= self.header.original_length:
+                return False
+            number = self.position // self.block_size
+            self.fileobj.seek(self.index[number].offset)
+            block_header = read_block_header(self.fileobj, self.index[number])
+            block = read_exactly(self.fileobj, block_header.compressed_size)
+            self.buffer = decompress_block(block, block_header.original_size, block_header.checksum)
+            self.buffer_start = number * self.block_size
+            return True
+        # Without an index, decode forwards until position is reached. The
+        # last next() finishes decompress_chunks, which checks the CRC.
+        while self.position >= self.buffer_start + len(self.buffer):
+            self.buffer_start += len(self.buffer)
+            self.buffer = next(self.chunks, b'')
+            if not self.buffer:
+                return False
+        return True
+
+    def buffer_offset(self):
+        # Offset of position in the buffer after refilling it if needed, or
+        # None at the end of the data
+        offset = self.position - self.buffer_start
+        if 0 <= offset < len(self.buffer):
+            return offset
+        if not self.fill_buffer():
+            return None
+        return self.position - self.buffer_start
+
+    def read(self, size=-1):
+        self.check_mode(READ)
+        if size is None or size < 0:
+            size = sys.maxsize
+        parts = []
+        while size > 0:
+            offset = self.buffer_offset()
+            if offset is None:
+                break
+            data = bytes(self.buffer[offset:offset + size])
+            parts.append(data)
+            self.position += len(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def read1(self, size=-1):
+        # Never decodes more than one block or chunk
+        self.check_mode(READ)
+        if size is None or size < 0:
+            size = sys.maxsize
+        offset = self.buffer_offset()
+        if offset is None or not size:
+            return b''
+        data = bytes(self.buffer[offset:offset + size])
+        self.position += len(data)
+        return data
+
+    def readinto(self, b):
+        with memoryview(b) as view, view.cast('B') as target:
+            data = self.read(len(target))
+            target[:len(data)] = data
+        return len(data)
+
+    def peek(self, size=0):
+        self.check_mode(READ)
+        offset = self.buffer_offset()
+        return b'' if offset is None else bytes(self.buffer[offset:])
+
+    def readline(self, size=-1):
+        # Searched for in the buffer, so iterating over lines costs a scan
+        # and a copy per line
+        self.check_mode(READ)
+        if size is None or size < 0:
+            size = sys.maxsize
+        parts = []
+        while size > 0:
+            offset = self.buffer_offset()
+            if offset is None:
+                break
+            end = min(len(self.buffer), offset + size)
+            newline = self.buffer.find(b'\n', offset, end)
+            if newline >= 0:
+                end = newline + 1
+            parts.append(bytes(self.buffer[offset:end]))
+            self.position += end - offset
+            size -= end - offset
+            if newline >= 0:
+                break
+        return b''.join(parts)
+
+    def original_length(self):
+        if self.header.layout != ADAPTIVE:
+            return self.header.original_length
+        # Only the trailer of an adaptive file records its length, so decode
+        # to the end to find it. A later seek backwards starts again.
+        position = self.position
+        self.position = sys.maxsize
+        self.fill_buffer()
+        self.position = position
+        return self.buffer_start
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.check_mode(READ)
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.original_length()
+        elif whence != io.SEEK_SET:
+            raise ValueError("Invalid whence: {}".format(whence))
+        if offset < 0:
+            raise ValueError("Negative seek position: {}".format(offset))
+
+        if self.index is None and offset < self.buffer_start:
+            # Without an index the data can only be decoded forwards, so
+            # seeking backwards starts again from the beginning
+            self.chunks.close()
+            self.fileobj.seek(self.start)
+            self.chunks = self.coder.decompress_chunks(self.fileobj, self.header)
+            self.buffer = b''
+            self.buffer_start = 0
+        self.position = offset
+        return self.position
+
+    def write(self, b):
+        self.check_mode(WRITE)
+        with memoryview(b) as view, view.cast('B') as data:
+            self.pending += data
+            size = len(data)
+        while len(self.pending) >= self.block_size:
+            self.write_block(self.pending[:self.block_size])
+            del self.pending[:self.block_size]
+        self.position += size
+        return size
+
+    def write_block(self, data):
+        data = bytes(data)
+        compressed = compress_block(data, self.coder.use_numpy, self.coder.max_code_length, self.coder.use_cache)
+        self.index.append(BlockIndexEntry(self.blocks.tell(), len(compressed), len(data)))
+        self.blocks.write(compressed)
+        self.crc = checksum(data, self.crc)
+        self.length += len(data)
+
+    def finish(self):
+        # The header and block index go first, then the blocks
+        if self.pending:
+            self.write_block(self.pending)
+            self.pending.clear()
+        blocks_start = HEADER.size + block_index_size(len(self.index))
+        index = [entry._replace(offset=blocks_start + entry.offset) for entry in self.index]
+        self.fileobj.write(pack_header(BLOCKS, self.coder.max_code_length, self.length, self.crc))
+        self.fileobj.write(pack_block_index(self.block_size, index))
+        self.blocks.seek(0)
+        shutil.copyfileobj(self.blocks, self.fileobj)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.mode == WRITE:
+                try:
+                    self.finish()
+                finally:
+                    self.blocks.close()
+            elif self.chunks is not None:
+                self.chunks.close()
+        finally:
+            try:
+                if self.owns_file:
+                    self.fileobj.close()
+            finally:
+                super().close()
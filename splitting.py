@@ -0,0 +1,38 @@
+from math import log2
+
+# Segment boundaries fall on multiples of this many input bytes
+UNIT_SIZE = 1 << 16
+
+# Most units in a segment. A segment's original size and its payload size,
+# at most canonical.MAX_CODE_LENGTH bits per byte, then both fit the 32-bit
+# fields of its header.
+MAX_SEGMENT_UNITS = (1 << 30) // UNIT_SIZE
+
+# Rough cost of starting a segment with its own table: the segment header
+# plus a nibble-packed code-length table, in bits
+TABLE_COST_BITS = 8 * 140
+
+
+def estimated_bits(histogram):
+    # Entropy of the histogram, which is close to its Huffman-coded size
+    total = sum(histogram)
+    return sum(count * log2(total / count) for count in histogram if count)
+
+
+def find_segments(unit_histograms, table_cost_bits=TABLE_COST_BITS, max_units=MAX_SEGMENT_UNITS):
+    # Greedy left-to-right split: a unit joins the current segment unless
+    # the segment is full or coding the unit separately saves more than a new
+    # table costs. Yields (unit count, histogram) per segment as soon as the
+    # next unit starts a new one, so only the current segment is held.
+    units = 0
+    for histogram in unit_histograms:
+        if units:
+            merged = [a + b for a, b in zip(current, histogram)]
+            merged_bits = estimated_bits(merged)
+            if units < max_units and merged_bits - current_bits - estimated_bits(histogram) <= table_cost_bits:
+                units, current, current_bits = units + 1, merged, merged_bits
+                continue
+            yield units, current
+        units, current, current_bits = 1, list(histogram), estimated_bits(histogram)
+    if units:
+        yield units, current
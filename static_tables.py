@@ -0,0 +1,86 @@
+import os
+import sys
+
+from code_lengths import huffman_code_lengths, limited_code_lengths
+from codebook import Codebook
+from histogram import histogram_from_file, merge_histograms
+
+# Longest code in a static table, so each length is a single hex digit
+STATIC_MAX_CODE_LENGTH = 15
+
+# Table IDs stored in .huff files. They are part of the file format: never
+# renumber or change a published table, only add new ones.
+TEXT = 1
+PDF = 2
+DOCX = 3
+JPEG = 4
+
+EXTENSION_TABLES = {
+    '.txt': TEXT,
+    '.pdf': PDF,
+    '.docx': DOCX,
+    '.jpg': JPEG,
+    '.jpeg': JPEG,
+}
+
+# Code lengths per table, one hex digit per byte value, from train_table on
+# sample uploads of each type
+STATIC_TABLES = {
+    TEXT: (
+        'dddddddddd7dd7dddddddddddddddddd4ddddddddddd8c9ddddddddddddddddd'
+        'dccbdcddc9cccbddbddcacdcddddddddd5464344457966567b55644894dddddd'
+        'dddddddddddddddddddddddddddddddddddddddddddddddddddddddddddddddd'
+        'dddddddddddddddddddddddddddddddddddddddddddddddddddddddddddddddd'
+    ),
+    PDF: (
+        '7888888898888888988898888888888879888888888888887888888888888888'
+        '8898888888888888888888888888888888888888888888888888888888888888'
+        '8888988888888888988888889888888888888888888888888888888888888888'
+        '8888888888888888888888888888888888888888888888888888888888888887'
+    ),
+    DOCX: (
+        '6888888888888888889888888888888888889888889888888888888888888888'
+        '8888888888888888888898888888888888888888888888888888888888888888'
+        '8888888888888888888888888888888888888888989888888888888888888888'
+        '8888888888888888888888888888888888888888888888888888888888888888'
+    ),
+    JPEG: (
+        '7888888888888888888888888888888878888888888888888888888888888888'
+        '8888888888888888888888888888888888888888888888888888888888888888'
+        '8888988888888888888888888888888888888888888888888888888888888888'
+        '8888888888888888888888888888898888888888988888988888888888888888'
+    ),
+}
+
+
+def train_table(paths):
+    # Code lengths for the combined histogram of sample files, one hex digit
+    # per byte value. Every byte gets a code, even one the samples never
+    # contain, so a static table can code any file.
+    frequency = [count + 1 for count in merge_histograms(histogram_from_file(path) for path in paths)]
+    lengths = huffman_code_lengths(frequency)
+    if max(lengths) > STATIC_MAX_CODE_LENGTH:
+        lengths = limited_code_lengths(frequency, STATIC_MAX_CODE_LENGTH)
+    return ''.join('{:x}'.format(length) for length in lengths)
+
+
+# Built once at import and shared read-only by every coder
+STATIC_CODEBOOKS = {table_id: Codebook(int(digit, 16) for digit in digits)
+                    for table_id, digits in STATIC_TABLES.items()}
+
+
+def static_codebook(table_id):
+    try:
+        return STATIC_CODEBOOKS[table_id]
+    except KeyError:
+        raise ValueError("Unknown static .huff table: {}".format(table_id)) from None
+
+
+def table_for_file(path):
+    # The static table for a file's content type, or None
+    return EXTENSION_TABLES.get(os.path.splitext(path)[1].lower())
+
+
+if __name__ == "__main__":
+    # python static_tables.py samples...; prints a table for STATIC_TABLES
+    print(train_table(sys.argv[1:]))
@@ -0,0 +1,104 @@
+import os
+import random
+
+from adaptive import AdaptiveHuffmanCoding
+from container import ADAPTIVE, BLOCKS, CONTEXT, EXTENDED, INTERLEAVED, SINGLE_TABLE, SPLIT, STATIC
+from huffman import HuffmanCoding
+from huffman_file import HuffmanFile
+
+
+def fibonacci_data(count=20):
+    # Symbol i occurs fib(i) times, which gives the longest codes possible
+    # for the number of symbols
+    counts = [1, 1]
+    while len(counts) < count:
+        counts.append(counts[-1] + counts[-2])
+    data = bytearray()
+    for symbol, occurrences in enumerate(counts):
+        data += bytes((symbol * 7,)) * occurrences
+    random.Random(1).shuffle(data)
+    return bytes(data)
+
+
+def text_data(lines=400):
+    words = [b'the', b'quick', b'brown', b'fox', b'jumps', b'over', b'lazy', b'dog', b'<item>', b'</item>', b'value']
+    rng = random.Random(2)
+    return b'\n'.join(b' '.join(rng.choice(words) for _ in range(12)) for _ in range(lines))
+
+
+INPUTS = {
+    'empty': b'',
+    'one-byte': b'x',
+    'one-symbol': b'a' * 5000,
+    'fibonacci': fibonacci_data(),
+    'random': random.Random(0).randbytes(20000),
+    'text': text_data(),
+}
+
+# Settings that select each layout, with the layout expected for text. None
+# stands for the adaptive coder.
+CODERS = {
+    'single': (dict(), SINGLE_TABLE),
+    'single-unmapped': (dict(use_mmap=False), SINGLE_TABLE),
+    'single-pure-python': (dict(use_numpy=False, use_mmap=False), SINGLE_TABLE),
+    'single-streamed': (dict(use_mmap=False, buffer_size=1000), SINGLE_TABLE),
+    'length-limited': (dict(max_code_length=12), SINGLE_TABLE),
+    'cached': (dict(use_cache=True), SINGLE_TABLE),
+    'blocks': (dict(block_size=4096, workers=1), BLOCKS),
+    'split': (dict(split_tables=True), SPLIT),
+    'interleaved': (dict(interleaved=True), INTERLEAVED),
+    'static': (dict(static_ratio=1e9), STATIC),
+    'context': (dict(context_model=True), CONTEXT),
+    'extended': (dict(extended_alphabet=True), EXTENDED),
+    'adaptive': (None, ADAPTIVE),
+}
+
+READERS = ['decompress', 'stream', 'bytes', 'range', 'file']
+
+
+def make_coder(coder_name):
+    settings = CODERS[coder_name][0]
+    return HuffmanCoding() if settings is None else HuffmanCoding(**settings)
+
+
+def write_file(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+    return str(path)
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def compress(tmp_path, coder_name, data):
+    # The original is written as .txt so that the static coder has a table
+    # for it, and removed so that decompress has to recreate it
+    input_file = write_file(tmp_path / 'data.txt', data)
+    if CODERS[coder_name][0] is None:
+        compressed_file = AdaptiveHuffmanCoding().compress(input_file)
+    else:
+        compressed_file = make_coder(coder_name).compress(input_file)
+    os.remove(input_file)
+    return compressed_file
+
+
+def decompress_with(reader, compressed_file, coder):
+    # Decode compressed_file completely through one of the public readers
+    if reader == 'decompress':
+        return read_file(coder.decompress(compressed_file))
+    if reader == 'stream':
+        return b''.join(coder.decompress_stream(compressed_file))
+    if reader == 'bytes':
+        return coder.decompress_bytes(read_file(compressed_file))
+    if reader == 'range':
+        return coder.decompress_range(compressed_file, 0, 1 << 30)
+    with HuffmanFile(compressed_file, coder=coder) as file:
+        return file.read()
+
+
+def corrupt(compressed_file, change):
+    data = bytearray(read_file(compressed_file))
+    change(data)
+    write_file(compressed_file, data)
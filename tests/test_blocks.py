@@ -0,0 +1,110 @@
+import os
+import random
+import struct
+
+import pytest
+
+from container import BLOCK_INDEX_ENTRY, BLOCK_LAYOUT, HEADER
+from huffman import HuffmanCoding
+from support import READERS, decompress_with, read_file, text_data, write_file
+
+DATA = text_data(2000)
+BLOCK_SIZE = 8192
+
+# Where the fields of index entry i start
+ENTRY = HEADER.size + BLOCK_LAYOUT.size
+
+
+def compress(tmp_path, workers=1):
+    input_file = write_file(tmp_path / 'data.txt', DATA)
+    compressed_file = HuffmanCoding(block_size=BLOCK_SIZE, workers=workers).compress(input_file)
+    os.remove(input_file)
+    return compressed_file
+
+
+def set_entry(number, field, value):
+    # Overwrite one field (0 offset, 1 size, 2 original size) of an entry
+    def change(data):
+        entry = list(BLOCK_INDEX_ENTRY.unpack_from(data, ENTRY + number * BLOCK_INDEX_ENTRY.size))
+        entry[field] = value(entry[field])
+        BLOCK_INDEX_ENTRY.pack_into(data, ENTRY + number * BLOCK_INDEX_ENTRY.size, *entry)
+    return change
+
+
+def swap_blocks(data):
+    first = BLOCK_INDEX_ENTRY.unpack_from(data, ENTRY)
+    second = BLOCK_INDEX_ENTRY.unpack_from(data, ENTRY + BLOCK_INDEX_ENTRY.size)
+    BLOCK_INDEX_ENTRY.pack_into(data, ENTRY, second[0], second[1], first[2])
+    BLOCK_INDEX_ENTRY.pack_into(data, ENTRY + BLOCK_INDEX_ENTRY.size, first[0], first[1], second[2])
+
+
+def wrong_checksum(data):
+    # The header ends with the CRC-32 of the whole file
+    data[HEADER.size - 1] ^= 1
+
+
+CORRUPTIONS = {
+    'offset-in-header': set_entry(1, 0, lambda offset: 3),
+    'offset-in-index': set_entry(1, 0, lambda offset: ENTRY + 5),
+    'offset-past-end': set_entry(1, 0, lambda offset: (1 << 64) - 1),
+    'size-too-large': set_entry(1, 1, lambda size: size + 1),
+    'size-too-small': set_entry(1, 1, lambda size: size - 1),
+    'short-block': set_entry(0, 2, lambda size: size - 1),
+    'block-count': lambda data: struct.pack_into('>I', data, HEADER.size + 4, 1),
+    'block-size': lambda data: struct.pack_into('>I', data, HEADER.size, 0),
+    'swapped-blocks': swap_blocks,
+    'wrong-checksum': wrong_checksum,
+}
+
+# Corruptions only the whole-file checksum catches, which HuffmanFile, as it
+# picks out blocks through the index, never computes
+WHOLE_FILE_ONLY = {'swapped-blocks', 'wrong-checksum'}
+
+
+@pytest.mark.parametrize('reader', READERS)
+@pytest.mark.parametrize('corruption', list(CORRUPTIONS))
+def test_corrupt_index(tmp_path, corruption, reader):
+    compressed_file = compress(tmp_path)
+    data = bytearray(read_file(compressed_file))
+    CORRUPTIONS[corruption](data)
+    write_file(compressed_file, data)
+    if reader == 'file' and corruption in WHOLE_FILE_ONLY:
+        pytest.skip("random access checks the checksum of each block, not of the file")
+    with pytest.raises(ValueError):
+        decompress_with(reader, compressed_file, HuffmanCoding(workers=1))
+
+
+def test_parallel_compress(tmp_path):
+    # Blocks coded on the process pool come back in order, so the file is
+    # the same as one compressed in this process
+    serial = read_file(compress(tmp_path, workers=1))
+    parallel_file = compress(tmp_path, workers=3)
+    assert read_file(parallel_file) == serial
+    assert read_file(HuffmanCoding(workers=1).decompress(parallel_file)) == DATA
+
+
+def test_parallel_decompress(tmp_path):
+    compressed_file = compress(tmp_path)
+    assert read_file(HuffmanCoding(workers=3).decompress(compressed_file)) == DATA
+
+
+def test_parallel_decompress_corrupt_block(tmp_path):
+    compressed_file = compress(tmp_path)
+    data = bytearray(read_file(compressed_file))
+    data[len(data) // 2] ^= 0x55
+    write_file(compressed_file, data)
+    with pytest.raises(ValueError):
+        HuffmanCoding(workers=3).decompress(compressed_file)
+    assert os.listdir(tmp_path) == ['data.txt.huff']
+
+
+def test_range_reads_only_covering_blocks(tmp_path):
+    # A damaged block outside the range is never read
+    compressed_file = compress(tmp_path)
+    data = bytearray(read_file(compressed_file))
+    last = len(DATA) // BLOCK_SIZE
+    last_offset, last_size = BLOCK_INDEX_ENTRY.unpack_from(data, ENTRY + last * BLOCK_INDEX_ENTRY.size)[:2]
+    data[last_offset + last_size - 1] ^= 0x55
+    write_file(compressed_file, data)
+    offset = random.Random(3).randrange(BLOCK_SIZE)
+    assert HuffmanCoding().decompress_range(compressed_file, offset, BLOCK_SIZE) == DATA[offset:offset + BLOCK_SIZE]
@@ -0,0 +1,27 @@
+import pytest
+
+import huffman
+from huffman import HuffmanCoding, compress_bytes, decompress_bytes
+from support import INPUTS, compress, make_coder, read_file
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+@pytest.mark.parametrize('input_name', list(INPUTS))
+def test_compress_bytes(input_name, use_numpy):
+    data = INPUTS[input_name]
+    coder = HuffmanCoding(use_numpy=use_numpy)
+    assert coder.decompress_bytes(coder.compress_bytes(data)) == data
+    assert decompress_bytes(memoryview(compress_bytes(bytearray(data)))) == data
+
+
+@pytest.mark.parametrize('coder_name', ['single', 'blocks', 'static'])
+def test_decompress_bytes_verifies_once(tmp_path, monkeypatch, coder_name):
+    # The layouts decoded straight from the buffer check the whole-file CRC
+    # exactly once
+    calls = []
+    verify = huffman.verify
+    monkeypatch.setattr(huffman, 'verify', lambda header, data: calls.append(header) or verify(header, data))
+    data = INPUTS['text']
+    compressed = read_file(compress(tmp_path, coder_name, data))
+    assert make_coder(coder_name).decompress_bytes(compressed) == data
+    assert len(calls) == 1
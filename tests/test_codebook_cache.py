@@ -0,0 +1,70 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from codebook import CodebookCache, codebook_cache
+from huffman import HuffmanCoding
+from support import read_file, text_data, write_file
+
+
+def histogram(seed):
+    rng = random.Random(seed)
+    return [rng.randrange(1, 1000) for _ in range(256)]
+
+
+def test_hits_and_misses():
+    cache = CodebookCache()
+    frequency = histogram(1)
+    codebook = cache.from_frequencies(frequency)
+    assert (cache.hits, cache.misses) == (0, 1)
+    # The same histogram scaled up has the same fingerprint
+    assert cache.from_frequencies([4 * count for count in frequency]) is codebook
+    # Decompressing finds the codebook by its lengths
+    assert cache.from_lengths(list(codebook.lengths)) is codebook
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert len(cache) == 1
+
+
+def test_limit_counts_codebooks():
+    cache = CodebookCache(max_size=2)
+    first, second, third = (cache.from_frequencies(histogram(seed)) for seed in range(3))
+    assert len({first.lengths, second.lengths, third.lengths}) == 3
+    assert len(cache) == 2
+    # The least recently used codebook went, under both of its keys
+    assert len(cache.fingerprints) == 2
+    misses = cache.misses
+    assert cache.from_lengths(first.lengths) is not first
+    assert cache.from_lengths(third.lengths) is third
+    assert cache.misses == misses + 1
+
+
+def test_recently_used_stays():
+    cache = CodebookCache(max_size=2)
+    first = cache.from_frequencies(histogram(0))
+    cache.from_frequencies(histogram(1))
+    cache.from_lengths(first.lengths)
+    cache.from_frequencies(histogram(2))
+    assert cache.from_frequencies(histogram(0)) is first
+
+
+def test_shared_between_threads():
+    cache = CodebookCache()
+    frequency = histogram(3)
+    with ThreadPoolExecutor(8) as pool:
+        codebooks = list(pool.map(lambda _: cache.from_frequencies(frequency), range(64)))
+    # Threads that built the codebook at the same time all get the one
+    # that was stored first
+    assert len(cache) == 1
+    assert all(codebook is codebooks[0] for codebook in codebooks)
+
+
+def test_coder_uses_cache(tmp_path):
+    codebook_cache.clear()
+    data = text_data()
+    coder = HuffmanCoding(use_cache=True, use_mmap=False)
+    for name in ('first.txt', 'second.txt'):
+        compressed_file = coder.compress(write_file(tmp_path / name, data))
+        assert read_file(coder.decompress(compressed_file)) == data
+    # One miss to build the codebook; the second compress and both
+    # decompresses find it
+    assert (codebook_cache.hits, codebook_cache.misses) == (3, 1)
+    assert len(codebook_cache) == 1
@@ -0,0 +1,56 @@
+import io
+import os
+import random
+
+import pytest
+
+from canonical import read_code_lengths
+from container import CONTEXT, HEADER, SINGLE_TABLE
+from huffman import HuffmanCoding
+from support import INPUTS, READERS, decompress_with, read_file, text_data, write_file
+
+
+def compress(tmp_path, data):
+    input_file = write_file(tmp_path / 'data.txt', data)
+    compressed_file = HuffmanCoding(context_model=True).compress(input_file)
+    os.remove(input_file)
+    return compressed_file
+
+
+@pytest.mark.parametrize('input_name', list(INPUTS))
+def test_never_worse_than_order_0(tmp_path, input_name):
+    data = INPUTS[input_name]
+    order_0 = HuffmanCoding().compress(write_file(tmp_path / 'order-0.txt', data))
+    order_1 = compress(tmp_path, data)
+    assert os.path.getsize(order_1) <= os.path.getsize(order_0)
+    assert read_file(HuffmanCoding().decompress(order_1)) == data
+
+
+@pytest.mark.parametrize('data, layout', [
+    (text_data(), CONTEXT),
+    (b'the context model does not pay for itself here', SINGLE_TABLE),
+    (random.Random(5).randbytes(50000), SINGLE_TABLE),
+])
+def test_layout_choice(tmp_path, data, layout):
+    assert read_file(compress(tmp_path, data))[5] == layout
+
+
+def set_table_count(count):
+    # The number of tables follows the context map
+    def change(data):
+        file = io.BytesIO(data)
+        file.seek(HEADER.size)
+        read_code_lengths(file)
+        data[file.tell()] = count
+    return change
+
+
+@pytest.mark.parametrize('reader', READERS)
+@pytest.mark.parametrize('count', [0, 1])
+def test_corrupt_context_map(tmp_path, count, reader):
+    compressed_file = compress(tmp_path, text_data())
+    data = bytearray(read_file(compressed_file))
+    set_table_count(count)(data)
+    write_file(compressed_file, data)
+    with pytest.raises(ValueError):
+        decompress_with(reader, compressed_file, HuffmanCoding())
@@ -0,0 +1,58 @@
+import io
+import random
+
+import pytest
+
+from canonical import MAX_CODE_LENGTH, RUN_LENGTH_TABLE
+from codebook import Codebook
+from container import HEADER, SINGLE_TABLE, checksum, pack_header
+from huffman import HuffmanCoding
+from support import CODERS, INPUTS, READERS, compress, decompress_with, make_coder, read_file, write_file
+
+# Run-length tables: (run - 1, length) pairs after the kind byte
+BAD_TABLES = {
+    'over-subscribed': bytes((RUN_LENGTH_TABLE, 255, 1)),
+    'too-long': bytes((RUN_LENGTH_TABLE, 253, 0, 0, 1, 0, MAX_CODE_LENGTH + 1)),
+    'far-too-long': bytes((RUN_LENGTH_TABLE, 254, 0, 0, 255)),
+}
+
+
+@pytest.mark.parametrize('table', list(BAD_TABLES))
+def test_bad_table(tmp_path, table):
+    with pytest.raises(ValueError):
+        Codebook.read(io.BytesIO(BAD_TABLES[table]))
+    data = INPUTS['text']
+    compressed = pack_header(SINGLE_TABLE, 0, len(data), checksum(data)) + BAD_TABLES[table] + bytes(1000)
+    compressed_file = write_file(tmp_path / 'data.txt.huff', compressed)
+    for reader in READERS:
+        with pytest.raises(ValueError):
+            decompress_with(reader, compressed_file, HuffmanCoding())
+
+
+def test_longest_code():
+    # Fibonacci counts over 40 symbols would give codes of 39 bits
+    counts = [1, 1]
+    while len(counts) < 40:
+        counts.append(counts[-1] + counts[-2])
+    codebook = Codebook.from_frequencies(counts + [0] * (256 - len(counts)))
+    assert codebook.max_length == MAX_CODE_LENGTH
+
+
+@pytest.mark.parametrize('reader', READERS)
+@pytest.mark.parametrize('coder_name', list(CODERS))
+def test_fuzzed_tables(tmp_path, coder_name, reader):
+    # Random bytes written over the tables at the start of the file (code
+    # lengths, context maps, phrases, block indexes) either go unnoticed or
+    # raise ValueError
+    compressed_file = compress(tmp_path, coder_name, INPUTS['text'])
+    original = read_file(compressed_file)
+    rng = random.Random(coder_name + reader)
+    for _ in range(20):
+        damaged = bytearray(original)
+        for _ in range(rng.randrange(1, 4)):
+            damaged[rng.randrange(HEADER.size, min(len(damaged), HEADER.size + 600))] = rng.randrange(256)
+        write_file(compressed_file, damaged)
+        try:
+            decompress_with(reader, compressed_file, make_coder(coder_name))
+        except ValueError:
+            pass
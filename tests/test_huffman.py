@@ -0,0 +1,78 @@
+import os
+import struct
+
+import pytest
+
+from container import HEADER
+from support import CODERS, INPUTS, READERS, compress, corrupt, decompress_with, make_coder, read_file
+
+
+@pytest.fixture(params=list(CODERS))
+def coder_name(request):
+    return request.param
+
+
+@pytest.fixture(params=list(INPUTS))
+def data(request):
+    return INPUTS[request.param]
+
+
+def test_decompress(tmp_path, coder_name, data):
+    compressed_file = compress(tmp_path, coder_name, data)
+    assert read_file(make_coder(coder_name).decompress(compressed_file)) == data
+
+
+def test_decompress_stream(tmp_path, coder_name, data):
+    compressed_file = compress(tmp_path, coder_name, data)
+    assert b''.join(make_coder(coder_name).decompress_stream(compressed_file, chunk_size=1000)) == data
+
+
+def test_decompress_bytes(tmp_path, coder_name, data):
+    compressed_file = compress(tmp_path, coder_name, data)
+    assert make_coder(coder_name).decompress_bytes(read_file(compressed_file)) == data
+
+
+def test_layout(tmp_path, coder_name):
+    compressed_file = compress(tmp_path, coder_name, INPUTS['text'])
+    assert read_file(compressed_file)[5] == CODERS[coder_name][1]
+
+
+def set_length(length):
+    def change(data):
+        data[7:15] = struct.pack('>Q', length)
+    return change
+
+
+def flip_byte(data):
+    data[HEADER.size + (len(data) - HEADER.size) * 3 // 4] ^= 0x55
+
+
+def truncate(data):
+    del data[len(data) * 3 // 4:]
+
+
+def bad_magic(data):
+    data[:4] = b'FUHH'
+
+
+CORRUPTIONS = {
+    'bad-magic': bad_magic,
+    'truncated': truncate,
+    'flipped-byte': flip_byte,
+    'length-plus-one': set_length(len(INPUTS['text']) + 1),
+    'length-minus-one': set_length(len(INPUTS['text']) - 1),
+    'huge-length': set_length(1 << 62),
+}
+
+
+@pytest.mark.parametrize('reader', READERS)
+@pytest.mark.parametrize('corruption', list(CORRUPTIONS))
+def test_corrupt_input(tmp_path, coder_name, corruption, reader):
+    if coder_name == 'adaptive' and 'length' in corruption:
+        pytest.skip("the adaptive layout keeps its length in the trailer")
+    compressed_file = compress(tmp_path, coder_name, INPUTS['text'])
+    corrupt(compressed_file, CORRUPTIONS[corruption])
+    with pytest.raises(ValueError):
+        decompress_with(reader, compressed_file, make_coder(coder_name))
+    # A failed decompress leaves no output behind
+    assert os.listdir(tmp_path) == ['data.txt.huff']
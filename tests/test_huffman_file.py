@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+from huffman import HuffmanCoding
+from huffman_file import HuffmanFile
+from support import CODERS, INPUTS, compress, make_coder, read_file, text_data
+
+
+@pytest.mark.parametrize('input_name', list(INPUTS))
+@pytest.mark.parametrize('coder_name', list(CODERS))
+def test_read_and_seek(tmp_path, coder_name, input_name):
+    data = INPUTS[input_name]
+    compressed_file = compress(tmp_path, coder_name, data)
+    with HuffmanFile(compressed_file, coder=make_coder(coder_name)) as file:
+        assert file.read() == data
+        file.seek(len(data) // 3)
+        assert file.read(100) == data[len(data) // 3:len(data) // 3 + 100]
+        file.seek(0)
+        assert file.read(7) == data[:7]
+        assert file.seek(0, io.SEEK_END) == len(data)
+        assert file.read() == b''
+
+
+@pytest.mark.parametrize('coder_name', ['single', 'blocks', 'split', 'adaptive'])
+def test_lines(tmp_path, coder_name):
+    # With the 4096-byte blocks of the blocks coder, lines cross block
+    # boundaries and one is longer than a block; the last has no newline
+    data = text_data(300) + b'\n' + b'x' * 10000 + b'\n\n' + b'end'
+    compressed_file = compress(tmp_path, coder_name, data)
+    with HuffmanFile(compressed_file, coder=make_coder(coder_name)) as file:
+        assert list(file) == data.splitlines(keepends=True)
+        assert file.readline() == b''
+        file.seek(0)
+        assert file.readlines() == data.splitlines(keepends=True)
+        file.seek(0)
+        first = data.splitlines(keepends=True)[0]
+        assert file.readline(5) == first[:5]
+        assert file.readline() == first[5:]
+        assert file.readline(0) == b''
+        assert file.tell() == len(first)
+
+
+@pytest.mark.parametrize('input_name', list(INPUTS))
+def test_write(tmp_path, input_name):
+    data = INPUTS[input_name]
+    compressed_file = str(tmp_path / 'data.huff')
+    with HuffmanFile(compressed_file, 'wb', block_size=4096) as file:
+        for start in range(0, len(data), 3000):
+            file.write(data[start:start + 3000])
+    with HuffmanFile(compressed_file) as file:
+        assert file.read() == data
+    assert read_file(HuffmanCoding(workers=1).decompress(compressed_file)) == data
@@ -0,0 +1,42 @@
+import io
+
+import pytest
+
+from canonical import MAX_CODE_LENGTH
+from codebook import Codebook
+from container import HEADER
+from huffman import HuffmanCoding
+from support import INPUTS, fibonacci_data, read_file, write_file
+
+
+@pytest.mark.parametrize('max_code_length', [0, -1, 7, MAX_CODE_LENGTH + 1, 256])
+def test_invalid_max_code_length(max_code_length):
+    with pytest.raises(ValueError):
+        HuffmanCoding(max_code_length=max_code_length)
+
+
+@pytest.mark.parametrize('max_code_length', [8, 10, 12, 16, MAX_CODE_LENGTH])
+@pytest.mark.parametrize('input_name', ['fibonacci', 'random', 'text'])
+def test_codes_within_limit(tmp_path, input_name, max_code_length):
+    data = INPUTS[input_name]
+    input_file = write_file(tmp_path / 'data.bin', data)
+    compressed_file = HuffmanCoding(max_code_length=max_code_length).compress(input_file)
+    compressed = read_file(compressed_file)
+    assert compressed[6] == max_code_length
+    codebook = Codebook.read(io.BytesIO(compressed[HEADER.size:]))
+    assert codebook.max_length <= max_code_length
+    assert read_file(HuffmanCoding().decompress(compressed_file)) == data
+
+
+def test_limit_only_when_needed():
+    # The 20-symbol Fibonacci histogram needs 19-bit codes; a limit above
+    # that leaves the optimal code alone, and a lower one costs bits
+    frequency = [0] * 256
+    for byte in fibonacci_data():
+        frequency[byte] += 1
+    optimal = Codebook.from_frequencies(frequency)
+    assert optimal.max_length == 19
+    assert Codebook.from_frequencies(frequency, 20).lengths == optimal.lengths
+    limited = Codebook.from_frequencies(frequency, 8)
+    assert limited.max_length == 8
+    assert sum(map(int.__mul__, frequency, limited.lengths)) > sum(map(int.__mul__, frequency, optimal.lengths))
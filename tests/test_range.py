@@ -0,0 +1,42 @@
+import pytest
+
+from huffman import HuffmanCoding
+from support import CODERS, INPUTS, compress, corrupt, make_coder
+
+
+@pytest.mark.parametrize('input_name', list(INPUTS))
+@pytest.mark.parametrize('coder_name', list(CODERS))
+def test_decompress_range(tmp_path, coder_name, input_name):
+    data = INPUTS[input_name]
+    compressed_file = compress(tmp_path, coder_name, data)
+    coder = make_coder(coder_name)
+    size = len(data)
+    for offset, length in [(0, 0), (0, 1), (5, 100), (4000, 5000), (size // 2, size), (max(size - 10, 0), 100),
+                           (size + 5, 10)]:
+        assert coder.decompress_range(compressed_file, offset, length) == data[offset:offset + length]
+
+
+def test_negative_range(tmp_path):
+    compressed_file = compress(tmp_path, 'single', INPUTS['text'])
+    with pytest.raises(ValueError):
+        HuffmanCoding().decompress_range(compressed_file, -1, 10)
+    with pytest.raises(ValueError):
+        HuffmanCoding().decompress_range(compressed_file, 0, -10)
+
+
+@pytest.mark.parametrize('coder_name', [name for name in CODERS if name != 'adaptive'])
+def test_whole_range_is_verified(tmp_path, coder_name):
+    # A payload byte flipped near the end changes the data, and a range
+    # covering the whole file notices
+    data = INPUTS['text']
+    compressed_file = compress(tmp_path, coder_name, data)
+    corrupt(compressed_file, flip_last_byte)
+    coder = make_coder(coder_name)
+    with pytest.raises(ValueError):
+        coder.decompress_range(compressed_file, 0, len(data))
+    with pytest.raises(ValueError):
+        coder.decompress_range(compressed_file, 0, len(data) + 100)
+
+
+def flip_last_byte(data):
+    data[-1] ^= 0x80
@@ -0,0 +1,40 @@
+import itertools
+import os
+import random
+
+from container import read_header
+from huffman import HuffmanCoding
+from splitting import UNIT_SIZE, find_segments
+from support import read_file, text_data, write_file
+
+
+def test_segments_are_bounded():
+    histogram = [1] * 256
+    assert list(find_segments([histogram] * 10, max_units=4)) == [(4, [4] * 256), (4, [4] * 256), (2, [2] * 256)]
+
+
+def test_segments_come_out_as_they_close():
+    # Text and random units alternate forever; each segment is yielded
+    # without reading the rest
+    text = [0] * 256
+    text[ord('e')] = text[ord(' ')] = 1000
+    noise = [50] * 256
+    segments = find_segments(itertools.cycle([text, text, noise, noise]))
+    assert next(segments) == (2, [2 * count for count in text])
+    assert next(segments) == (2, [2 * count for count in noise])
+
+
+def test_split_file(tmp_path):
+    # Two units of text, two of random bytes and a short one of text again
+    # give a segment for each
+    text = text_data(3000)
+    data = text[:2 * UNIT_SIZE] + random.Random(4).randbytes(2 * UNIT_SIZE) + text[:1000]
+    input_file = write_file(tmp_path / 'data.bin', data)
+    compressed_file = HuffmanCoding(split_tables=True).compress(input_file)
+    os.remove(input_file)
+    assert read_file(HuffmanCoding().decompress(compressed_file)) == data
+    coder = HuffmanCoding()
+    with open(compressed_file, 'rb') as file:
+        segments = [segment_header.original_size for segment_header, codebook in
+                    coder.read_segments(file, read_header(file))]
+    assert segments == [2 * UNIT_SIZE, 2 * UNIT_SIZE, 1000]
@@ -0,0 +1,48 @@
+import pytest
+
+from container import SINGLE_TABLE, STATIC
+from huffman import HuffmanCoding
+from static_tables import TEXT, table_for_file
+from support import INPUTS, read_file, write_file
+
+
+def layout_of(tmp_path, file_name, data, **settings):
+    input_file = write_file(tmp_path / file_name, data)
+    compressed_file = HuffmanCoding(**settings).compress(input_file)
+    assert read_file(HuffmanCoding().decompress(compressed_file)) == data
+    return read_file(compressed_file)[5]
+
+
+def test_table_for_file():
+    assert table_for_file('notes.txt') == TEXT
+    assert table_for_file('NOTES.TXT') == TEXT
+    assert table_for_file('data.bin') is None
+    assert table_for_file('README') is None
+
+
+@pytest.mark.parametrize('static_ratio, layout', [(1e9, STATIC), (1.5, STATIC), (0.5, SINGLE_TABLE)])
+def test_ratio_decides(tmp_path, static_ratio, layout):
+    # The shipped text table codes this text in about a quarter more bits
+    # than its own table does, so a ratio of 1.5 takes the static table and
+    # 0.5 does not
+    assert layout_of(tmp_path, 'data.txt', INPUTS['text'], static_ratio=static_ratio) == layout
+
+
+def test_poor_fit_keeps_own_table(tmp_path):
+    # Random bytes are far from text, so even at ratio 1 the file's own
+    # table wins
+    assert layout_of(tmp_path, 'data.txt', INPUTS['random'], static_ratio=1.0) == SINGLE_TABLE
+
+
+def test_no_table_for_extension(tmp_path):
+    assert layout_of(tmp_path, 'data.bin', INPUTS['text'], static_ratio=1e9) == SINGLE_TABLE
+
+
+def test_static_table_too_long_for_limit(tmp_path):
+    # The text table has codes longer than 12 bits, so a 12-bit limit rules
+    # it out
+    assert layout_of(tmp_path, 'data.txt', INPUTS['text'], static_ratio=1e9, max_code_length=12) == SINGLE_TABLE
+
+
+def test_empty_file_uses_static_table(tmp_path):
+    assert layout_of(tmp_path, 'data.txt', b'', static_ratio=1.0) == STATIC
@@ -0,0 +1,31 @@
+import pytest
+
+from huffman import HuffmanCoding
+from support import INPUTS, read_file, write_file
+
+
+def compress_with(tmp_path, data, **settings):
+    input_file = write_file(tmp_path / 'data.bin', data)
+    return read_file(HuffmanCoding(**settings).compress(input_file))
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+@pytest.mark.parametrize('buffer_size', [7, 1000, 1 << 16])
+@pytest.mark.parametrize('input_name', list(INPUTS))
+def test_streamed_matches_whole_file(tmp_path, input_name, buffer_size, use_numpy):
+    # Reading the input buffer_size bytes at a time changes neither the
+    # table nor the codes, so the output is byte for byte the same
+    data = INPUTS[input_name]
+    whole = compress_with(tmp_path, data, use_numpy=use_numpy)
+    streamed = compress_with(tmp_path, data, use_numpy=use_numpy, use_mmap=False, buffer_size=buffer_size)
+    assert streamed == whole
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 1 << 16])
+def test_decompress_stream_chunks(tmp_path, chunk_size):
+    data = INPUTS['text']
+    input_file = write_file(tmp_path / 'data.bin', data)
+    compressed_file = HuffmanCoding().compress(input_file)
+    chunks = list(HuffmanCoding().decompress_stream(compressed_file, chunk_size))
+    assert b''.join(chunks) == data
+    assert all(len(chunk) <= chunk_size for chunk in chunks)